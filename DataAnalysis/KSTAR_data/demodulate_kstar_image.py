@@ -3,6 +3,8 @@ import matplotlib.pyplot as plt
 import scipy.ndimage as ndimage
 import scipy.ndimage.filters as filters
 
+from DataAnalysis import filter_bank
+
 def fft_2D(image):
     return np.fft.fft2(image, axes=(0,1))
 
@@ -14,12 +16,7 @@ def get_carrier_frequency(image):
     return shift_image
 
 def box_filter(image, x_size, y_size, centre):
-
-    mask = np.zeros((np.shape(image)))
-
-    mask[centre[1] - int((y_size/2)-0.5): centre[1] + int((y_size/2)+0.5), centre[0] - int((x_size/2)-0.5):centre[0] + int((x_size/2)+0.5)] = 1.
-
-    return mask
+    return filter_bank.get_mask(np.shape(image), tuple(centre), (x_size, y_size), anchor='centre')
 
 def find_maxima(image, neighborhood_size, threshold):
     data_max = filters.maximum_filter(image, neighborhood_size)
@@ -40,7 +37,7 @@ def find_maxima(image, neighborhood_size, threshold):
 
 def filter_image(mask, shift_image):
 
-    filtered_image = shift_image*mask
+    filtered_image = mask.apply(shift_image)
 
     ifft_image = np.fft.ifft2(filtered_image)
 
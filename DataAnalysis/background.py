@@ -0,0 +1,98 @@
+import os
+import numpy as np
+
+from DataAnalysis.read_binary import load_binary
+from DataAnalysis.read_binary_ASH import load_ashbinary
+
+#Master dark frames built from background acquisitions (eg. sam_12.dat) and background subtraction.
+
+#A master dark is the per-pixel median (or mean) over every frame of a background file. It is calculated once, saved
+#alongside the background file as <filename>.<system>_<method>_dark.npz and reloaded from there (or from memory) on
+#later runs, as long as the background file has not changed.
+
+_master_darks = {}
+
+def _load_frames(filename, system):
+
+    if system == 'ASH':
+        images, step, theta0 = load_ashbinary(filename, FLC=False)
+    elif system == 'FLC':
+        images = load_binary(filename, FLC=True)
+    else:
+        raise ValueError("Unrecognised system {}, choose 'ASH' or 'FLC'".format(system))
+
+    return images
+
+def _dark_filename(filename, system, method, cache_dir):
+
+    directory = os.path.dirname(os.path.abspath(filename)) if cache_dir is None else cache_dir
+
+    return os.path.join(directory, '{}.{}_{}_dark.npz'.format(os.path.basename(filename), system, method))
+
+def master_dark(filename, system='ASH', method='median', cache_dir=None):
+
+    """
+    :param filename: Binary file containing the background frames.
+    :param system: 'ASH' or 'FLC', the binary format of the file.
+    :param method: 'median' or 'mean' over the frames.
+    :param cache_dir: Where to save the master dark, defaults to the directory of the background file.
+    :return: Master dark in counts (Array - nx, ny) in the same orientation as the raw frames.
+    """
+
+    if method not in ('median', 'mean'):
+        raise ValueError("Unrecognised method {}, choose 'median' or 'mean'".format(method))
+
+    source = os.stat(filename)
+    key = (os.path.abspath(filename), system, method, source.st_mtime, source.st_size)
+
+    if key in _master_darks:
+        return _master_darks[key]
+
+    dark_file = _dark_filename(filename, system, method, cache_dir)
+    dark = None
+
+    if os.path.exists(dark_file):
+        with np.load(dark_file) as saved:
+            if saved['source_mtime'] == source.st_mtime and saved['source_size'] == source.st_size:
+                dark = saved['dark']
+
+    if dark is None:
+        frames = _load_frames(filename, system)
+
+        if method == 'median':
+            dark = np.median(frames, axis=2)
+        else:
+            dark = np.mean(frames, axis=2)
+
+        dark = np.round(dark).astype(np.int32)
+
+        np.savez(dark_file, dark=dark, source_mtime=source.st_mtime, source_size=source.st_size)
+
+    dark.setflags(write=False)
+    _master_darks[key] = dark
+
+    return dark
+
+def subtract_dark(frames, dark, out=None):
+
+    """
+    Subtract a master dark and clip negative counts to zero, casting to int32 inside the subtraction rather than
+    making cast copies of the frames and the dark.
+    :param frames: Single frame (Array - nx, ny) or a stack of frames (Array - nx, ny, n_frames).
+    :param dark: Master dark (Array - nx, ny), in the same orientation as the frames.
+    :param out: int32 array to write the result into, may be the frames themselves if they are int32. Allocated if None.
+    :return: Background subtracted frames (int32).
+    """
+
+    dark = np.asarray(dark)
+
+    if np.ndim(frames) == dark.ndim + 1:
+        dark = dark[..., np.newaxis]
+
+    if out is None:
+        out = np.empty(np.shape(frames), dtype=np.int32)
+
+    np.subtract(frames, dark, out=out, dtype=np.int32, casting='unsafe')
+    np.maximum(out, 0, out=out)
+
+    return out
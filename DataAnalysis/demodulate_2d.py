@@ -2,11 +2,15 @@
 import numpy as np
 import os
 import matplotlib.pyplot as plt
+from functools import lru_cache
 from DataAnalysis.peak_find import indexes
 from scipy.optimize import curve_fit
 
 #Internal imports
 from DataAnalysis.read_binary import load_binary
+from DataAnalysis import filter_bank
+from DataAnalysis.polariser_calibration import fit_linear_offset, LinearCalibration
+from Tools.calibration_store import CalibrationStore, data_key
 
 def get_images(filename):
     images = load_binary(filename, FLC=True)
@@ -47,12 +51,8 @@ def createCircularMask(h, w, center=None, radius=None):
     if radius is None: # use the smallest distance between the center and image walls
         radius = min(center[0], center[1], w-center[0], h-center[1])
 
-    Y, X = np.ogrid[:h, :w]
-    dist_from_center = np.sqrt((X - center[0])**2 + (Y-center[1])**2)
-
-    mask = dist_from_center <= radius
-
-    mask = mask * 1.0
+    #cached boolean disc covering only the pixels near the center
+    mask = filter_bank.get_mask((h, w), tuple(center), radius, kind='circle')
 
     #true_mask = np.argwhere(mask==1.0)
 
@@ -62,7 +62,7 @@ def createCircularMask(h, w, center=None, radius=None):
 
 def filter_image(mask, shift_image):
 
-    filtered_image = shift_image*mask
+    filtered_image = mask.apply(shift_image)
 
     ifft_image = np.fft.ifft2(filtered_image)
 
@@ -162,6 +162,20 @@ def calculate_offset(ny, nx, phase_diff, start, end,flip):
 
     return polariser_angles, phase_offsets, y_fit, offset, central_offsets, rotary_stage_angles
 
+def calculate_offset_map(phase_diff, start, end, flip):
+
+    """
+    Same fit as calculate_offset, but for every pixel in the image rather than just the center.
+    :return: LinearCalibration - gradient, intercept, offset and residual maps (Array - ny, nx)
+    """
+
+    rotary_stage_angles = np.arange(0,180,10)
+
+    phase_offsets = phase_diff[start:end]*(180./np.pi)
+    polariser_angles = rotary_stage_angles[start:end]
+
+    return fit_linear_offset(polariser_angles, phase_offsets, flip=flip)
+
 def offset_from_reference(phase_diff, nx, ny, n_frames):
 
     reference_image = phase_diff[0,:,:]
@@ -250,15 +264,42 @@ frame = np.arange(0,38,1)
 
 filename = str(os.getcwd()) + '/sam_8.dat'
 
-phases, phase_diff = calculate_phase(n_frames, filename, frame)
+#The fits are kept in the calibration store, keyed on the contents of the file, so the phase is only calculated and
+#fitted the first time a measurement is processed
+
+calibration_store = CalibrationStore()
+optics = {'FLC': True, 'data': data_key(get_images(filename))}
+
+@lru_cache(maxsize=1)
+def measured_phase_diff():
+    phases, phase_diff = calculate_phase(n_frames, filename, frame)
+    return phase_diff
+
+offset_fields = ('polariser_angles', 'phase_offsets', 'y_fit', 'offset', 'central_offsets', 'rotary_stage_angles')
+
+def stored_offset(start, end, flip):
+    calibration = calibration_store.get_or_compute('flip_offset', lambda: dict(zip(offset_fields, calculate_offset(ny, nx, measured_phase_diff(), start, end, flip))),
+                                                   camera='IMSE', optics=dict(optics, start=start, end=end, flip=flip))
+    return tuple(calibration[field] for field in offset_fields)
+
+def stored_offset_map(start, end, flip):
+    calibration = calibration_store.get_or_compute('polariser_offset_map', lambda: calculate_offset_map(measured_phase_diff(), start, end, flip)._asdict(),
+                                                   camera='IMSE', optics=dict(optics, start=start, end=end, flip=flip))
+    return LinearCalibration(**calibration)
+
+polariser_angles_set1, phase_offsets_set1, y_fit_set1, offset_set1,  central_offsets_set1, rotary_stage_angles_set1 = stored_offset(start=0, end=7, flip=0)
+polariser_angles_set2, phase_offsets_set2, y_fit_set2, offset_set2,  central_offsets_set2, rotary_stage_angles_set2 = stored_offset(start=8, end=13, flip=np.pi/2)
+polariser_angles_set3, phase_offsets_set3, y_fit_set3, offset_set3,  central_offsets_set3, rotary_stage_angles_set3 = stored_offset(start=14, end=18, flip=np.pi)
+
+#Full field calibration, the polariser offset at every pixel for each set
 
-polariser_angles_set1, phase_offsets_set1, y_fit_set1, offset_set1,  central_offsets_set1, rotary_stage_angles_set1 = calculate_offset(ny, nx, phase_diff, start=0, end=7, flip=0)
-polariser_angles_set2, phase_offsets_set2, y_fit_set2, offset_set2,  central_offsets_set2, rotary_stage_angles_set2 = calculate_offset(ny, nx, phase_diff, start=8, end=13, flip=np.pi/2)
-polariser_angles_set3, phase_offsets_set3, y_fit_set3, offset_set3,  central_offsets_set3, rotary_stage_angles_set3 = calculate_offset(ny, nx, phase_diff, start=14, end=18, flip=np.pi)
+offset_map_set1 = stored_offset_map(start=0, end=7, flip=0)
+offset_map_set2 = stored_offset_map(start=8, end=13, flip=np.pi/2)
+offset_map_set3 = stored_offset_map(start=14, end=18, flip=np.pi)
 
 #Calculate the offset using the first FLC state image as a reference
 
-#offset_images = offset_from_reference(phase_diff, nx, ny, n_frames)
+#offset_images = offset_from_reference(measured_phase_diff(), nx, ny, n_frames)
 #polariser_angles, phase_offsets, y_fit = calculate_offset_from_reference(ny, nx, offset_images)
 
 residual_offset_1 = (phase_offsets_set1/4 - polariser_angles_set1) - offset_set1
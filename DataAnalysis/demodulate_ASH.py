@@ -20,7 +20,11 @@ plt.rc('legend', fontsize=SMALL_SIZE)    # legend fontsize
 plt.rc('figure', titlesize=BIGGER_SIZE)  # fontsize of the figure title
 
 #Internal imports
-from DataAnalysis.read_binary_ASH import load_ashbinary
+from DataAnalysis.read_binary_ASH import load_ashbinary, fit_polariser_offset
+from DataAnalysis import filter_bank
+from DataAnalysis.sidebands import demodulate_sidebands
+from DataAnalysis.background import master_dark, subtract_dark
+from Tools.calibration_store import CalibrationStore
 
 def get_images(filename):
     images, step, theta0 = load_ashbinary(filename=filename, FLC=False)
@@ -30,26 +34,19 @@ def single_image(images, frame):
     image = images[:,:,frame]
     return image.T
 
-def subtract_background(image, background):
-    image_background = image.astype(np.int32) - (background[:,:,0].T).astype(np.int32)
-    image_background[np.where(image_background<0)] = 0
-    return image_background
+def subtract_background(image, background, out=None):
+    #background is the master dark in the raw frame orientation, images from single_image are transposed
+    return subtract_dark(image, background.T, out=out)
 
 def fft_2D(image):
     return np.fft.fft2(image, axes=(0,1))
 
-def box_filter(image, x_size, y_size, centre):
-    x = len(image[0,:])
-    y = len(image[:,0])
-
-    mask = np.zeros((np.shape(image)))
-
-    mask[centre[1]:centre[1] + y_size, centre[0]:centre[0] + x_size] = 1.
-
-    return mask
+def box_filter(image, x_size, y_size, centre, kind='box'):
+    #centre is the lower corner of the box
+    return filter_bank.get_mask(np.shape(image), tuple(centre), (x_size, y_size), kind=kind, anchor='corner')
 
 def apply_mask(image, mask):
-    return image*mask
+    return mask.apply(image)
 
 def unwrap(phase_array):
 
@@ -82,22 +79,24 @@ def unwrap(phase_array):
 
     return phase_uw
 
-def apply_filters(image, image_fft):
-    #filter the displacer phase
-    phi_dfilter = box_filter(image, x_size=41, y_size=25, centre=[1255,1010])
-
-    #filter phi_d + phi_s
-    phid_plus_phi_s = box_filter(image, x_size = 41, y_size=25, centre=[1305,1010])
+def carrier_filters(image):
+    #filter the displacer phase, phi_d + phi_s and phi_d - phi_s
+    return {'phi_d': box_filter(image, x_size=41, y_size=25, centre=[1255,1010]),
+            'phi_d+phi_s': box_filter(image, x_size = 41, y_size=25, centre=[1305,1010]),
+            'phi_d-phi_s': box_filter(image, x_size = 41, y_size=25, centre=[1210,1010])}
 
-    #filter phi_d - phi_s
-    phid_minus_phi_s = box_filter(image, x_size = 41, y_size=25, centre=[1210,1010])
+def apply_filters(image, image_fft):
+    filters = carrier_filters(image)
+    phi_dfilter = filters['phi_d']
+    phid_plus_phi_s = filters['phi_d+phi_s']
+    phid_minus_phi_s = filters['phi_d-phi_s']
 
     #apply filters
-    image_phid = phi_dfilter * image_fft
+    image_phid = phi_dfilter.apply(image_fft)
 
-    image_pos = phid_plus_phi_s * image_fft
+    image_pos = phid_plus_phi_s.apply(image_fft)
 
-    image_neg = phid_minus_phi_s * image_fft
+    image_neg = phid_minus_phi_s.apply(image_fft)
 
     # plt.figure()
     # plt.imshow(abs(np.log10(image_fft)))
@@ -135,12 +134,12 @@ def blur_image(im, n, ny=None) :
     improc = signal.convolve(im,g, mode='valid')
     return(improc)
 
-def demodulate(background, frame):
+def demodulate(background, frame, out=None):
     #get one frame
     image = single_image(images, frame=frame)
 
     #subtract background
-    image_bg = subtract_background(image, background)
+    image_bg = subtract_background(image, background, out=out)
 
     # plt.figure()
     # plt.imshow(image_bg)
@@ -158,14 +157,10 @@ def demodulate(background, frame):
     #shift so DC in center
     image_fft = np.fft.fftshift(fft_image)
 
-    #apply filters for each carrier frequency (phi_d, phi_d + phi_s, phi_d - phi_s
+    #crop out each carrier frequency (phi_d, phi_d + phi_s, phi_d - phi_s) and IFFT them together
 
-    image_phid, image_pos, image_neg = apply_filters(image, image_fft)
-
-    #IFFT
-    image_pos_ifft = np.fft.ifft2(image_pos)
-    image_neg_ifft = np.fft.ifft2(image_neg)
-    image_phid_ifft = np.fft.ifft2(image_phid)
+    sidebands = demodulate_sidebands(image_bg, carrier_filters(image), spectrum=image_fft)
+    image_phid_ifft, image_pos_ifft, image_neg_ifft = sidebands.amplitude
 
     # plt.figure()
     # plt.title('A(+ +- )')
@@ -221,16 +216,25 @@ def demodulate(background, frame):
     return theta_ave
 
 filename ='/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_13.dat'
-background ='/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_12.dat'
+background_filename ='/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_12.dat'
+scan_filename ='/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_11.dat'
+run = 13 #bench run number, sam_13.dat
+scan_run = 11
 
 images, step, theta0 = get_images(filename)
-background, background_step, background_theta0 = get_images(background)
+background = master_dark(background_filename, system='ASH', method='median')
 n_frames = 37
 polarisation = np.zeros(n_frames)
+frame_buffer = np.empty(np.shape(single_image(images, frame=0)), dtype=np.int32)
 for i in range(n_frames):
-    polarisation[i] = demodulate(background, frame=i)
-
-offset = 49.3479565 #degrees
+    polarisation[i] = demodulate(background, frame=i, out=frame_buffer)
+
+#polariser offset fitted from the rotary stage scan sam_11.dat the first time, then read from the calibration store
+#for the runs from the scan onwards
+calibration_store = CalibrationStore()
+calibration = calibration_store.get_or_compute('polariser_offset', lambda: {'offset': fit_polariser_offset(scan_filename, background_filename)},
+                                               shot=run, camera='ASH', first_shot=scan_run)
+offset = float(calibration['offset']) #degrees
 offset_rad = offset*(np.pi/180.)
 input_theta = np.linspace(theta0,360.,n_frames)*(np.pi/180.)
 ideal = abs(np.arctan(np.sin((2*input_theta+offset_rad))/np.cos((2*input_theta+offset_rad))))/2.
@@ -2,15 +2,14 @@
 import os
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import signal
 
 #Internal imports
 from DataAnalysis.read_binary import load_binary
-from DataAnalysis.peak_find import indexes
+from DataAnalysis.peak_find import indexes, peak_mask
+from DataAnalysis import filter_bank
 
-def prepare_image(filename, frames):
+def prepare_image(images, frames):
 
-    images = load_binary(filename, FLC=True)
     image = images[:, :, frames].astype(np.float64)
     image = image / np.max(image)
 
@@ -43,7 +42,7 @@ def make_window(image_slice, ny):
     #Design filter around the positive or negative carrier frequency
 
     #window[peaks[0] - fringe_width: peaks[0] + fringe_width + 1] = signal.hann(fringe_width*2+1)
-    window[peaks[-1] - fringe_width: peaks[-1] + fringe_width + 1 ] = signal.hann(fringe_width*2+1)
+    window[peaks[-1] - fringe_width: peaks[-1] + fringe_width + 1 ] = filter_bank.window('hann', fringe_width*2+1)
 
     return window, fringe_width, peaks, fft_column
 
@@ -62,6 +61,65 @@ def filter_image(window, fft_column):
 
     return intensity, phase
 
+def make_windows(image, fft_rows):
+
+    """
+    Batched version of make_window, designs the carrier window for every row of the image at once.
+    :param image: Normalised image, rows are demodulated along the last axis.
+    :param fft_rows: fftshifted FFT of every row of the image.
+    :return: windows (Array - rows, ny), fringe widths and positions of the carrier peak for each row.
+    """
+
+    n_rows, ny = np.shape(image)
+
+    # find the peaks of the carrier frequency at /pm f and DC
+    carrier_peaks = peak_mask(abs(fft_rows), thres=0.2)
+    fringe_peaks = peak_mask(abs(image), thres=0.7, min_dist=10)
+
+    #Design filter around the positive carrier frequency, the last peak in each row
+
+    has_carrier = np.any(carrier_peaks, axis=1)
+    carrier = ny - 1 - np.argmax(carrier_peaks[:, ::-1], axis=1)
+
+    #Fringe width from the spacing of the first two fringes, or 4 pixels if fewer than two are found
+
+    first = np.argmax(fringe_peaks, axis=1)
+    later_peaks = fringe_peaks.copy()
+    later_peaks[np.arange(n_rows), first] = False
+    second = np.argmax(later_peaks, axis=1)
+    fringe_width = np.where(np.count_nonzero(fringe_peaks, axis=1) > 1, (second - first) // 2, 4)
+
+    #Hann window of length fringe_width*2+1 centred on the carrier, clipped at the edges of the spectrum
+
+    offset = np.arange(ny)[np.newaxis, :] - (carrier - fringe_width)[:, np.newaxis]
+    length = 2 * fringe_width[:, np.newaxis]
+    inside = (offset >= 0) & (offset <= length) & has_carrier[:, np.newaxis]
+
+    hann = np.where(length > 0, 0.5 - 0.5 * np.cos(2 * np.pi * offset / np.maximum(length, 1)), 1.)
+    windows = np.where(inside, hann, 0.)
+
+    return windows, fringe_width, carrier
+
+def demodulate_rows(image):
+
+    """
+    Demodulate every row of an image together. Equivalent to calling take_slice, make_window and filter_image
+    for each row in turn, but uses one FFT and one inverse FFT along the rows for the whole frame.
+    :param image: Normalised image (Array - rows, ny)
+    :return: intensity, phase (Array - rows, ny)
+    """
+
+    fft_rows = np.fft.fftshift(np.fft.fft(image, axis=1), axes=1)
+
+    windows, fringe_width, carrier = make_windows(image, fft_rows)
+
+    ifft_rows = np.fft.ifft(windows * fft_rows, axis=1)
+
+    intensity = 2 * abs(ifft_rows) #amplitude of the carrier frequency
+    phase = np.angle(ifft_rows)
+
+    return intensity, phase
+
 # from Pycis - import the module when I can clone the git.
 
 def unwrap(phase_array):
@@ -103,22 +161,17 @@ ny = 1080
 n_frames = 38
 n_states = 2
 frames = np.arange(0,38,1)
-pixels = np.arange(0,ny,1)
 
 Intensity = np.zeros((nx, ny, n_frames))
 Phase = np.zeros((nx, ny, n_frames))
 filtered_image = np.zeros((nx, ny, n_frames))
 Theta = np.zeros((nx,ny,n_frames))
 
+images = load_binary(filename, FLC=True)
+
 for n in frames:
-    image = prepare_image(filename, frames[n])
-
-    for i in range(len(pixels)):
-        image_slice = take_slice(image, pixels[i])
-        window, fringe_width, peaks, fft_column = make_window(image_slice, ny)
-        intensity_slice, phase_slice = filter_image(window, fft_column)
-        Intensity[i,:,n] = intensity_slice
-        Phase[i,:,n] = phase_slice
+    image = prepare_image(images, frames[n])
+    Intensity[:,:,n], Phase[:,:,n] = demodulate_rows(image)
 
 phase_unwrapped = np.zeros((nx,ny,n_frames))
 phase_differences = []
@@ -0,0 +1,287 @@
+import numpy as np
+from collections import namedtuple
+from functools import lru_cache
+from scipy import signal
+
+#Cache of carrier filters and window functions used to demodulate IMSE images.
+
+#Filters are stored in compact form, as the region of the spectrum they cover plus the weights inside that region,
+#rather than as dense float64 arrays the size of the image. Cached filters are shared between callers, so their
+#arrays are read-only.
+
+CACHE_SIZE = 128
+
+FilterMetrics = namedtuple('FilterMetrics', 'crosstalk sidelobe_level efficiency')
+
+class Mask(object):
+
+    """
+    A carrier filter over part of a spectrum.
+
+    :param shape: Shape of the full spectrum the filter applies to.
+    :param region: Tuple of slices giving the part of the spectrum covered by the filter.
+    :param weights: None for a hard-edged box, otherwise a boolean or float array the shape of the region.
+    """
+
+    def __init__(self, shape, region, weights=None):
+
+        self.shape = tuple(shape)
+        self.region = tuple(region)
+        self.weights = weights
+
+    @property
+    def region_shape(self):
+        return tuple(sl.stop - sl.start for sl in self.region)
+
+    def crop(self, spectrum):
+
+        """
+        :param spectrum: Spectrum (or stack of spectra along the leading axes) the filter is applied to.
+        :return: The filtered part of the spectrum covered by the filter region.
+        """
+
+        cropped = spectrum[(Ellipsis,) + self.region]
+
+        if self.weights is None:
+            return cropped.copy()
+        elif self.weights.dtype == bool:
+            return np.where(self.weights, cropped, 0)
+        else:
+            return cropped * self.weights
+
+    def apply(self, spectrum):
+
+        """
+        Equivalent to multiplying the spectrum by the dense mask, but only touches the filter region.
+        :param spectrum: Spectrum (or stack of spectra along the leading axes) the filter is applied to.
+        :return: Filtered spectrum, the same shape as the input.
+        """
+
+        cropped = self.crop(spectrum)
+        filtered = np.zeros(np.shape(spectrum), dtype=np.result_type(spectrum, cropped))
+        filtered[(Ellipsis,) + self.region] = cropped
+
+        return filtered
+
+    def dense(self):
+        """Dense float64 version of the filter, for plotting."""
+        return self.apply(np.ones(self.shape))
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.dense()
+        return mask if dtype is None else mask.astype(dtype)
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+def _clip_region(shape, lower, upper):
+    return tuple(slice(int(max(lo, 0)), int(min(max(hi, 0), n))) for lo, hi, n in zip(lower, upper, shape))
+
+#Apodisation profiles as a function of the normalised distance u from the filter centre, u = +-1 at the filter edge.
+#Parameters follow the name in a kind tuple, eg. ('tukey', 0.5) or ('supergaussian', 0.4, 4).
+
+def _box(u):
+    return np.ones_like(u)
+
+def _hann(u):
+    return 0.5 * (1 + np.cos(np.pi * u))
+
+def _tukey(u, alpha=0.5):
+    # flat top over |u| < 1 - alpha, cosine taper to zero at the edge
+    taper = np.clip((abs(u) - (1 - alpha)) / max(alpha, 1e-12), 0., 1.)
+    return 0.5 * (1 + np.cos(np.pi * taper))
+
+def _gaussian(u, sigma=0.4):
+    return np.exp(-u**2 / (2 * sigma**2))
+
+def _supergaussian(u, sigma=0.4, order=4):
+    return np.exp(-(u**2 / (2 * sigma**2))**order)
+
+PROFILES = {'box': _box,
+            'hann': _hann,
+            'tukey': _tukey,
+            'gaussian': _gaussian,
+            'supergaussian': _supergaussian}
+
+def _split_kind(kind):
+    if isinstance(kind, tuple):
+        return kind[0], kind[1:]
+    return kind, ()
+
+def profile(kind, u):
+
+    """
+    :param kind: Name of the apodisation profile, or a (name, parameters) tuple.
+    :param u: Normalised distance from the filter centre, the profile is zero for |u| > 1.
+    :return: Weights at u.
+    """
+
+    name, params = _split_kind(kind)
+    u = np.asarray(u, dtype=np.float64)
+
+    return np.where(abs(u) <= 1, PROFILES[name](u, *params), 0.)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def window(kind, length):
+
+    """
+    Symmetric 1D window function, ie. window('hann', n) is equivalent to signal.hann(n).
+    :param kind: One of the PROFILES, or any other window accepted by scipy.signal.get_window, as a string or
+                 a (name, parameters) tuple.
+    :param length: Number of points in the window.
+    :return: Read-only window (Array - length)
+    """
+
+    length = int(length)
+
+    if _split_kind(kind)[0] in PROFILES:
+        if length == 1:
+            return _read_only(np.ones(1))
+        return _read_only(profile(kind, np.linspace(-1., 1., length)))
+
+    return _read_only(signal.get_window(kind, length, fftbins=False))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_mask(shape, centre, size, kind='box', anchor='centre', radial=False):
+
+    """
+    Cached carrier filter keyed by (shape, centre, size, window type). Filters are only built the first time
+    they are asked for.
+    :param shape: Shape of the spectrum (y, x).
+    :param centre: Position of the filter as (x, y) pixel coordinates.
+    :param size: Filter size as (x_size, y_size), or the radius for a radial filter.
+    :param kind: 'box' for a hard-edged box, 'circle' for a hard-edged disc, or a window (see window()) for an
+                 apodised filter.
+    :param anchor: 'centre' if centre is the middle of the box (as in Demodulate_TSSSH.box_filter), or 'corner' if
+                   it is the lower corner (as in demodulate_ASH.box_filter). Ignored for radial filters.
+    :param radial: If True the window is a function of the distance from the centre, otherwise it is separable in x and y.
+    :return: Mask
+    """
+
+    if kind == 'circle':
+        return _circular_mask(shape, centre, size)
+
+    if radial:
+        return _radial_mask(shape, centre, size, kind)
+
+    x_size, y_size = size
+
+    if anchor == 'centre':
+        lower = (centre[1] - int((y_size/2)-0.5), centre[0] - int((x_size/2)-0.5))
+        upper = (centre[1] + int((y_size/2)+0.5), centre[0] + int((x_size/2)+0.5))
+    elif anchor == 'corner':
+        lower = (centre[1], centre[0])
+        upper = (centre[1] + y_size, centre[0] + x_size)
+    else:
+        raise ValueError("Unrecognised anchor {}, choose 'centre' or 'corner'".format(anchor))
+
+    region = _clip_region(shape, lower, upper)
+
+    if kind == 'box':
+        return Mask(shape, region)
+
+    #Separable window over the full box, cropped to the part that lies inside the spectrum
+
+    y_window = window(kind, upper[0] - lower[0])[region[0].start - lower[0]:region[0].stop - lower[0]]
+    x_window = window(kind, upper[1] - lower[1])[region[1].start - lower[1]:region[1].stop - lower[1]]
+
+    return Mask(shape, region, _read_only(np.outer(y_window, x_window)))
+
+def _circular_mask(shape, centre, radius):
+
+    h, w = shape
+
+    lower = (np.floor(centre[1] - radius), np.floor(centre[0] - radius))
+    upper = (np.ceil(centre[1] + radius) + 1, np.ceil(centre[0] + radius) + 1)
+    region = _clip_region(shape, lower, upper)
+
+    Y, X = np.ogrid[region[0], region[1]]
+    weights = (X - centre[0])**2 + (Y - centre[1])**2 <= radius**2
+
+    return Mask(shape, region, _read_only(weights))
+
+def _radial_mask(shape, centre, radius, kind):
+
+    mask = _circular_mask(shape, centre, radius)
+
+    Y, X = np.ogrid[mask.region[0], mask.region[1]]
+    weights = profile(kind, np.sqrt((X - centre[0])**2 + (Y - centre[1])**2) / max(radius, 1e-12))
+
+    return Mask(shape, mask.region, _read_only(weights))
+
+def _dirichlet(offset, n):
+    # Spectral line shape of a carrier observed over n pixels, as a function of the offset in frequency bins
+    offset = np.asarray(offset, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kernel = np.sin(np.pi * offset) / (n * np.sin(np.pi * offset / n))
+    return np.where(np.isfinite(kernel), abs(kernel), 1.)
+
+def _sidelobe_level(weights):
+    # Peak sidelobe of the point spread function of a 1D cut through the filter, relative to the main lobe
+    n = len(weights)
+    if n < 2:
+        return 1.
+    psf = abs(np.fft.fft(weights, 16 * n))
+    psf = psf[:8 * n] / psf[0]
+    rising = np.nonzero(np.diff(psf) > 0)[0]
+    return psf[rising[0] + 1:].max() if len(rising) else 0.
+
+def characterise(mask, separation):
+
+    """
+    Leakage metrics for a carrier filter, used to pick the smallest filter (and so the smallest cropped inverse FFT)
+    that keeps neighbouring sidebands out.
+    :param mask: Mask centred on the carrier.
+    :param separation: Offset (x, y) in pixels of the nearest neighbouring carrier in the spectrum.
+    :return: FilterMetrics -
+             crosstalk: Amplitude picked up from the neighbouring carrier relative to the carrier itself. Both
+                        carriers are taken half way between frequency bins, the worst case for spectral leakage.
+             sidelobe_level: Peak sidelobe of the filter point spread function relative to its main lobe, which sets
+                             the ringing (and so phase error) around sharp features in the demodulated image.
+             efficiency: Fraction of the carrier amplitude over the whole spectrum passed by the filter, which
+                         grows with the filter size.
+    """
+
+    ny, nx = mask.shape
+    Y, X = np.ogrid[mask.region[0], mask.region[1]]
+    weights = np.ones(mask.region_shape) if mask.weights is None else mask.weights.astype(np.float64)
+
+    #Centre of the filter from the weighted mean position
+    total = weights.sum()
+    x0 = (weights * X).sum() / total
+    y0 = (weights * Y).sum() / total
+
+    carrier = _dirichlet(X - x0 - 0.5, nx) * _dirichlet(Y - y0 - 0.5, ny)
+    neighbour = _dirichlet(X - x0 - separation[0] - 0.5, nx) * _dirichlet(Y - y0 - separation[1] - 0.5, ny)
+
+    signal_amplitude = (weights * carrier).sum()
+    crosstalk = (weights * neighbour).sum() / signal_amplitude
+    #The carrier leaks into every bin of the spectrum, so the fraction passed is taken over the full spectrum rather
+    #than the filter region (over which a box would always pass all of it)
+    total_amplitude = _dirichlet(np.arange(nx) - x0 - 0.5, nx).sum() * _dirichlet(np.arange(ny) - y0 - 0.5, ny).sum()
+    efficiency = signal_amplitude / total_amplitude
+
+    iy, ix = int(round(y0)) - mask.region[0].start, int(round(x0)) - mask.region[1].start
+    sidelobe_level = max(_sidelobe_level(weights[iy, :]), _sidelobe_level(weights[:, ix]))
+
+    return FilterMetrics(crosstalk, sidelobe_level, efficiency)
+
+def smallest_size(shape, centre, separation, sizes, kind='hann', radial=False, max_crosstalk=1e-2, max_sidelobe=None):
+
+    """
+    :param sizes: Candidate filter sizes, smallest first, in the form taken by get_mask.
+    :return: The first size whose filter meets the crosstalk (and optionally sidelobe) limits and its metrics,
+             or (None, None) if none do.
+    """
+
+    for size in sizes:
+        metrics = characterise(get_mask(shape, centre, size, kind=kind, radial=radial), separation)
+        if metrics.crosstalk <= max_crosstalk and (max_sidelobe is None or metrics.sidelobe_level <= max_sidelobe):
+            return size, metrics
+
+    return None, None
+
+def clear_cache():
+    window.cache_clear()
+    get_mask.cache_clear()
@@ -26,6 +26,7 @@ SOFTWARE.
 
 
 import numpy as np
+from scipy.ndimage import minimum_filter1d, maximum_filter1d
 
 
 def indexes(y, thres=0.3, min_dist=1):
@@ -51,29 +52,85 @@ def indexes(y, thres=0.3, min_dist=1):
     ndarray
         Array containing the indexes of the peaks that were detected
     """
+    return np.nonzero(peak_mask(np.asarray(y)[np.newaxis, :], thres=thres, min_dist=min_dist)[0])[0]
+
+
+def indexes_2d(y, thres=0.3, min_dist=1):
+    """Row-wise peak detection routine.
+
+    Runs the same search as *indexes* on every row of *y* in one call. The
+    threshold is normalised separately for each row.
+
+    Parameters
+    ----------
+    y : ndarray (signed)
+        2D amplitude data, peaks are searched for along the last axis.
+    thres : float between [0., 1.]
+        Normalized threshold, applied per row.
+    min_dist : int
+        Minimum distance between each detected peak in a row.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Row and column indexes of the detected peaks, ordered by row then column.
+    """
+    return np.nonzero(peak_mask(y, thres=thres, min_dist=min_dist))
+
+
+def peak_mask(y, thres=0.3, min_dist=1):
+    """Boolean mask of the peaks found by *indexes_2d*, the same shape as *y*."""
     if isinstance(y, np.ndarray) and np.issubdtype(y.dtype, np.unsignedinteger):
         raise ValueError("y must be signed")
 
-    thres = thres * (np.max(y) - np.min(y)) + np.min(y)
+    y = np.asarray(y, dtype=np.float64)
+    if y.ndim != 2:
+        raise ValueError("y must be 2D, use indexes() for 1D data")
+
+    y_min = np.min(y, axis=1, keepdims=True)
+    thres = thres * (np.max(y, axis=1, keepdims=True) - y_min) + y_min
     min_dist = int(min_dist)
 
     # find the peaks by using the first order difference
-    dy = np.diff(y)
-    peaks = np.where((np.hstack([dy, 0.]) < 0.)
-                     & (np.hstack([0., dy]) > 0.)
-                     & (y > thres))[0]
+    dy = np.diff(y, axis=1)
+    pad = np.zeros((y.shape[0], 1))
+    peaks = ((np.hstack([dy, pad]) < 0.)
+             & (np.hstack([pad, dy]) > 0.)
+             & (y > thres))
 
-    if peaks.size > 1 and min_dist > 1:
-        highest = peaks[np.argsort(y[peaks])][::-1]
-        rem = np.ones(y.size, dtype=bool)
-        rem[peaks] = False
+    if min_dist > 1 and np.any(np.count_nonzero(peaks, axis=1) > 1):
+        peaks = _suppress_neighbours(y, peaks, min_dist)
 
-        for peak in highest:
-            if not rem[peak]:
-                sl = slice(max(0, peak - min_dist), peak + min_dist + 1)
-                rem[sl] = True
-                rem[peak] = False
+    return peaks
 
-        peaks = np.arange(y.size)[~rem]
 
-    return peaks
+def _suppress_neighbours(y, peaks, min_dist):
+    """
+    Greedy minimum distance suppression, equivalent to visiting the peaks from the highest down and discarding
+    any peak within min_dist of one already kept. Each pass keeps every candidate that outranks all of the
+    undecided candidates in its neighbourhood, then discards whatever those kept peaks cover, so the number
+    of passes depends on how the peaks chain together rather than on how many there are.
+    """
+    rows, cols = np.nonzero(peaks)
+
+    # rank every peak by height within its row, 0 being the highest
+    order = np.lexsort((y[rows, cols], rows))
+    rows, cols = rows[order], cols[order]
+    counts = np.bincount(rows, minlength=y.shape[0])
+    starts = np.cumsum(counts) - counts
+    rank = np.full(y.shape, np.inf)
+    rank[rows, cols] = counts[rows] - 1 - (np.arange(len(rows)) - starts[rows])
+
+    size = 2 * min_dist + 1
+    kept = np.zeros(y.shape, dtype=bool)
+    undecided = peaks.copy()
+
+    while np.any(undecided):
+        candidate_rank = np.where(undecided, rank, np.inf)
+        local_best = minimum_filter1d(candidate_rank, size, axis=1, mode='constant', cval=np.inf)
+        new = undecided & (candidate_rank == local_best)
+        kept |= new
+        covered = maximum_filter1d(new.view(np.uint8), size, axis=1, mode='constant', cval=0).astype(bool)
+        undecided &= ~covered
+
+    return kept
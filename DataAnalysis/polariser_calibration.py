@@ -0,0 +1,81 @@
+import numpy as np
+from collections import namedtuple
+
+#Polariser calibration fitted at every pixel at once.
+
+#Both calibration models are linear in their parameters, so the least squares solution is the pseudo-inverse of a
+#small design matrix (one row per polariser angle) applied to every pixel, with no loop over pixels. Pixels are
+#processed in chunks to bound the memory used by large frame stacks.
+
+LinearCalibration = namedtuple('LinearCalibration', 'gradient intercept offset residual')
+MalusCalibration = namedtuple('MalusCalibration', 'mean amplitude angle residual')
+
+def _least_squares(design, data, chunk_size):
+
+    """
+    :param design: Design matrix (Array - n_angles, n_parameters).
+    :param data: Measurements (Array - n_angles, ...) with any number of pixel dimensions.
+    :return: Fitted parameters (Array - n_parameters, ...) and rms residual (Array - ...).
+    """
+
+    data = np.asarray(data)
+    n_angles = len(design)
+    pixel_shape = data.shape[1:]
+
+    pixels = data.reshape(n_angles, -1)
+    pseudo_inverse = np.linalg.pinv(design)
+
+    parameters = np.empty((design.shape[1], pixels.shape[1]))
+    residual = np.empty(pixels.shape[1])
+
+    for start in range(0, pixels.shape[1], chunk_size):
+        chunk = pixels[:, start:start + chunk_size].astype(np.float64)
+        fit = pseudo_inverse @ chunk
+        parameters[:, start:start + chunk_size] = fit
+        residual[start:start + chunk_size] = np.sqrt(np.mean((design @ fit - chunk)**2, axis=0))
+
+    return parameters.reshape((design.shape[1],) + pixel_shape), residual.reshape(pixel_shape)
+
+def fit_linear_offset(polariser_angles, phase_offsets, flip=0., chunk_size=2**18):
+
+    """
+    Per-pixel version of the fit in demodulate_2d.calculate_offset, phase_offset = gradient * polariser_angle + intercept.
+    :param polariser_angles: Polariser (rotary stage) angles in degrees (Array - n_angles).
+    :param phase_offsets: Measured phase offset 4*theta_out - theta_polariser in degrees (Array - n_angles, ny, nx).
+    :param flip: Offset added to account for the phase jump the angles were taken after.
+    :return: LinearCalibration of maps (Array - ny, nx): gradient, intercept, polariser offset (intercept/4 + flip)
+             and rms residual of the fit.
+    """
+
+    polariser_angles = np.asarray(polariser_angles, dtype=np.float64)
+    design = np.stack([polariser_angles, np.ones_like(polariser_angles)], axis=1)
+
+    (gradient, intercept), residual = _least_squares(design, phase_offsets, chunk_size)
+
+    return LinearCalibration(gradient, intercept, intercept/4 + flip, residual)
+
+def fit_malus(theta, intensities, chunk_size=2**18):
+
+    """
+    Per-pixel fit of the intensity through a rotating polariser, I = mean + amplitude * cos(2*(theta - angle)),
+    solved as the linear model I = a + b*cos(2 theta) + c*sin(2 theta).
+    :param theta: Polariser angles in radians (Array - n_angles).
+    :param intensities: Background subtracted intensities (Array - n_angles, ny, nx).
+    :return: MalusCalibration of maps (Array - ny, nx): mean intensity, modulation amplitude, angle of maximum
+             transmission in radians (in [-pi/2, pi/2]) and rms residual of the fit.
+    """
+
+    theta = np.asarray(theta, dtype=np.float64)
+    design = np.stack([np.ones_like(theta), np.cos(2*theta), np.sin(2*theta)], axis=1)
+
+    (a, b, c), residual = _least_squares(design, intensities, chunk_size)
+
+    return MalusCalibration(a, np.sqrt(b**2 + c**2), 0.5*np.arctan2(c, b), residual)
+
+def save_calibration(filename, calibration):
+    np.savez(filename, kind=type(calibration).__name__, **calibration._asdict())
+
+def load_calibration(filename):
+    with np.load(filename) as saved:
+        kind = {'LinearCalibration': LinearCalibration, 'MalusCalibration': MalusCalibration}[str(saved['kind'])]
+        return kind(**{field: saved[field] for field in kind._fields})
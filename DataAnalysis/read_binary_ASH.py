@@ -1,3 +1,4 @@
+import os
 import numpy as np
 
 #Read a .dat binary file which contains images from the IMSE diagnostic system.
@@ -51,31 +52,49 @@ import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 
 #calculate the offset between the polariser angle vs what we put in via rotary stage
+
+def fit_polariser_offset(filename, background_filename, pixel=(1080, 1180), n_frames=37):
+
+    """
+    Fit the offset between the polariser angle and the angle set on the rotary stage, ie. from sam_11.dat.
+    :param filename: Binary file of the rotary stage scan.
+    :param background_filename: Binary file of the background frames, ie. sam_12.dat.
+    :param pixel: Pixel the intensity through the scan is taken from.
+    :param n_frames: Number of frames (polariser angles) in the scan.
+    :return: Polariser offset in degrees.
+    """
+
+    images, step, theta0 = load_ashbinary(filename, FLC=False)
+    bg, bgstep, bgtheta0 = load_ashbinary(background_filename, FLC=False)
+
+    theta = np.linspace(theta0,360.,n_frames)*(np.pi/180.)
+
+    def fit(theta,a):
+        return 0.25 + 0.25*np.cos(2*(-a+(3*np.pi/4.)-theta))
+
+    image_slice = images[pixel[0],pixel[1],:].astype(np.int32) - bg[pixel[0],pixel[1],:].astype(np.int32)
+
+    guess = [0.82]
+    popt, pcov = curve_fit(fit, theta, image_slice, p0=guess)
+
+    return float(popt[0]*(180./np.pi))
+
+def save_polariser_offset(calibration_store, filename, background_filename, pixel=(1080, 1180)):
+
+    """
+    Fit the polariser offset and save it in the calibration store, where demodulate_ASH reads it from.
+    :param calibration_store: Tools.calibration_store.CalibrationStore to save the offset in.
+    :return: Polariser offset in degrees.
+    """
+
+    offset = fit_polariser_offset(filename, background_filename, pixel=pixel)
+
+    calibration_store.save('polariser_offset', {'offset': offset}, camera='ASH', source=os.path.abspath(filename),
+                           background=os.path.abspath(background_filename), pixel=list(pixel))
+
+    return offset
+
+# from Tools.calibration_store import CalibrationStore
 #
-# filename = '/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_11.dat'
-# images, step, theta0 = load_ashbinary(filename, FLC=False)
-#
-# n_frames = 37
-# theta = np.linspace(theta0,360.,n_frames)*(np.pi/180.)
-#
-# def fit(theta,a):
-#     return 0.25 + 0.25*np.cos(2*(-a+(3*np.pi/4.)-theta))
-#
-# bg, bgstep, bgtheta0 = load_ashbinary('/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_12.dat', FLC=False)
-#
-# image_slice =  images[1080,1180,:].astype(np.int32) - bg[1080,1180,:].astype(np.int32)
-#
-# guess = [0.82]
-# popt, pcov = curve_fit(fit, theta, image_slice, p0=guess)
-#
-# y_fit = image_slice*fit(theta,popt)
-#
-# print(popt*(180./np.pi))
-#
-# plt.figure()
-# plt.plot(theta*(180/np.pi), images[1080,1280,:]/np.max(images[1028,1280,:]))
-# plt.plot(theta*(180./np.pi), y_fit/np.max(y_fit), '--', label='fit')
-# plt.legend()
-# plt.ylabel('I')
-# plt.xlabel('Polariser angle (degrees)')
-# plt.show()
+# save_polariser_offset(CalibrationStore(), '/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_11.dat',
+#                       '/home/sam/Desktop/Projects/IMSE-MSE/DataAnalysis/sam_12.dat')
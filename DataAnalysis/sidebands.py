@@ -0,0 +1,63 @@
+import numpy as np
+from collections import namedtuple
+
+#Demodulate several carrier frequencies from one image using a single forward FFT.
+
+#Each sideband is cropped out of the spectrum with its filter, moved to zero frequency, and all of the (small) cropped
+#spectra are inverse transformed together. The demodulated images therefore have the resolution of the filter rather
+#than of the camera, which is all the information the filter passes. Amplitudes are scaled to match a full size
+#inverse FFT of the filtered spectrum. Phases are relative to the carrier, the linear carrier phase ramp is removed.
+
+Sidebands = namedtuple('Sidebands', 'names amplitude phase')
+
+def shifted_spectrum(image):
+    #fftshift so DC frequency is in the center, the frame filters are defined in
+    return np.fft.fftshift(np.fft.fft2(image, axes=(0,1)))
+
+def demodulate_sidebands(image, filters, shape=None, spectrum=None):
+
+    """
+    :param image: Image to demodulate (Array - y, x). Not used if the shifted spectrum is given.
+    :param filters: Dictionary of {name: filter_bank.Mask} for each carrier, or a list of masks.
+    :param shape: Shape of the demodulated images. Defaults to the largest filter region, use the image shape to get
+                  images at full resolution.
+    :param spectrum: fftshifted 2D FFT of the image, if already calculated.
+    :return: Sidebands - names: Name (or index) of each carrier,
+                         amplitude: Amplitude of each carrier (Array - n_carriers, shape)
+                         phase: Phase of each carrier (Array - n_carriers, shape)
+    """
+
+    if isinstance(filters, dict):
+        names = list(filters.keys())
+        masks = list(filters.values())
+    else:
+        names = list(range(len(filters)))
+        masks = list(filters)
+
+    if spectrum is None:
+        spectrum = shifted_spectrum(image)
+
+    if shape is None:
+        shape = tuple(np.max([mask.region_shape for mask in masks], axis=0))
+
+    #Place each cropped sideband centred on zero frequency in a common stack
+
+    stack = np.zeros((len(masks),) + tuple(shape), dtype=complex)
+    centre = np.array(shape) // 2
+
+    for i, mask in enumerate(masks):
+        cropped = mask.crop(spectrum)
+        crop_shape = np.array(cropped.shape)
+
+        if np.any(crop_shape > np.array(shape)):
+            raise ValueError("Filter {} covers {} pixels, larger than the output shape {}".format(names[i], cropped.shape, shape))
+
+        start = centre - crop_shape // 2
+        stack[i, start[0]:start[0] + crop_shape[0], start[1]:start[1] + crop_shape[1]] = cropped
+
+    #One batched inverse FFT over every sideband
+
+    carriers = np.fft.ifft2(np.fft.ifftshift(stack, axes=(1, 2)), axes=(1, 2))
+    carriers *= np.prod(shape) / np.prod(np.shape(spectrum))
+
+    return Sidebands(names, abs(carriers), np.angle(carriers))
@@ -17,6 +17,31 @@ class Light():
 
         self.wavelength = msesim.wavelength*10**-9
 
+    @classmethod
+    def from_stokes(cls, stokes_vector, wavelength, x=None, y=None):
+        """
+        :param stokes_vector: Stokes vectors in the MSESIM layout (Array - ..., 4, n_wavelength), ie. the output of
+                              Tools.synthetic_spectrum.synthetic_spectra.
+        :param wavelength: Wavelength grid in m.
+        :param x: Horizontal position of the pixels on the sensor.
+        :param y: Vertical position of the pixels on the sensor.
+        :return: Light with the given Stokes components, without an MSESIM run.
+        """
+
+        light = cls.__new__(cls)
+
+        light.stokes_vector = stokes_vector
+        light.S0 = stokes_vector[..., 0, :]
+        light.S1 = stokes_vector[..., 1, :]
+        light.S2 = stokes_vector[..., 2, :]
+        light.S3 = stokes_vector[..., 3, :]
+        light.x = x
+        light.y = y
+
+        light.wavelength = np.asarray(wavelength)
+
+        return light
+
     def interact(self, phi, S0, S1, S2, FLC):
         """
         :param phi: Phase delay imposed upon light from the uniaxial crystal
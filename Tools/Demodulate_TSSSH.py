@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from Tools.Plotting.graph_format import plot_format
+from DataAnalysis import filter_bank
 
 import matplotlib.pyplot as plt
 
@@ -12,13 +13,11 @@ def load_image(filename):
     return image
 
 def hanning_window(image):
-    h = np.hamming(len(image))
-    b = np.ones((np.shape(image)))
-    return (b.T*h).T
+    return filter_bank.window('hamming', len(image))
 
 def apply_hanning(image):
     window = hanning_window(image)
-    return window*image
+    return (image.T*window).T
 
 def fft_2D(image):
     return np.fft.fft2(image)
@@ -36,17 +35,12 @@ def get_carrier_frequency(image):
 
     return shift_image
 
-def box_filter(image, x_size, y_size, centre):
-
-    mask = np.zeros((np.shape(image)))
-
-    mask[centre[1] - int(((y_size/2)-0.5)): centre[1] + int((y_size/2)+0.5), centre[0]- int((x_size/2)-0.5):centre[0] + int((x_size/2)+0.5)] = 1.
-
-    return mask
+def box_filter(image, x_size, y_size, centre, kind='box'):
+    return filter_bank.get_mask(np.shape(image), tuple(centre), (x_size, y_size), kind=kind, anchor='centre')
 
 def filter_image(mask, shift_image):
 
-    filtered_image = shift_image*mask
+    filtered_image = mask.apply(shift_image)
 
     plt.figure()
     plt.imshow(np.log10(abs(filtered_image)))
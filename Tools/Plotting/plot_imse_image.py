@@ -4,7 +4,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from Tools.load_msesim import MSESIM
 from scipy.io import readsav
-import pyuda
+from Tools.data_access import get_client
+from Tools.current_density import bz_from_polarisation, current_density
 from scipy.interpolate import interp1d, interp2d
 
 def get_geometry_coefficients():
@@ -42,7 +43,7 @@ def calculate_Bz(a0, a2, a3, a5, eq):
 
     # calculate Bz from the polarisation angle and the toroidal field from the equilibrium - fix up a sign error from the equilibrium (plasma current was +ve, not -ve for this equilibrium)
 
-    Bz = (np.tan(-1 * polarisation_angle) * a5 - a2) * Bphi / (a0 - np.tan(-1 * polarisation_angle) * a3)
+    Bz = bz_from_polarisation(polarisation_angle, a0, a2, a3, a5, Bphi, sign=-1.)
 
     return Bz
 
@@ -54,40 +55,20 @@ def calculate_Br(r, z, eq):
     
     return Br
 
-def calculate_current(Bz,Br):
+def calculate_current(r, z, Bz, Br):
 
-    mu_0 = 1.256
+    # j_phi = (dBr/dz - dBz/dR)/mu_0 in strips of rows, in MA/m^2 - R decreases across the columns of the image, as in
+    # the other plots
 
+    r_image = r[::-1]
 
-    grad_r = np.gradient(r)
-    grad_z = np.gradient(z)
+    j_phi = current_density(Bz, r_image, z, Br=Br) * 10**-6
 
-    dBzdr = np.gradient(Bz, axis=0)/grad_r
+    rr, zz = np.meshgrid(r_image, z)
 
     plt.figure()
-    plt.imshow(dBzdr/1.256)
-    plt.colorbar()
-    plt.clim(-0.1,1)
-    plt.show()
-
-    dBrdz = np.gradient(Br, axis=1)/grad_z
-
-    plt.figure()
-    plt.imshow(dBzdr)
-    plt.colorbar()
-    plt.show()
-
-    # plt.figure()
-    # plt.imshow(dBrdz)
-    # plt.colorbar()
-    # plt.show()
-
-    j_phi = (dBrdz - dBzdr)/mu_0
-
-    plt.figure()
-    plt.pcolormesh(rr[::-1], zz, j_phi, rasterized=True, shading='gourand')
+    plt.pcolormesh(rr, zz, j_phi, rasterized=True, shading='gouraud')
     cbar = plt.colorbar(label='$j_{\phi}$ MA/m$^{2}$')
-    # plt.clim(0.1, 0.75)
     plt.xlabel('R')
     plt.ylabel('Z')
     plt.show()
@@ -155,7 +136,7 @@ def plot_Bz(r,z,Bz,eq):
 
     return
 
-client = pyuda.Client()
+client = get_client('uda')
 
 #filepaths to the imse images
 
@@ -1,4 +1,3 @@
-import pyuda
 from scipy.interpolate import interp2d, interp1d
 from scipy.io import readsav
 
@@ -6,7 +5,11 @@ import idlbridge as idl
 import xarray as xr
 import matplotlib.pyplot as plt
 
-client = pyuda.Client()
+from Tools.calibration_store import CalibrationStore
+from Tools.data_access import get_client
+from Tools.current_density import bz_from_polarisation
+
+client = get_client('uda')
 
 import numpy as np
 
@@ -46,13 +49,21 @@ def create_dataset(fname):
 
     return gamma_dataset
 
-def calc_current(fname, eq):
+def fetch_acoeffs(shot):
+    return {'acoeff': client.get('AMS_ACOEFF', shot).data,
+            'rpos': client.get('AMS_RPOS', shot).data}
+
+def calc_current(fname, eq, calibration_store=None):
 
     gamma_dataset = create_dataset(fname)
     # get the A coefficients from the database from a previous calibration
+    if calibration_store is None:
+        calibration_store = CalibrationStore()
+
+    calibration = calibration_store.get_or_compute('ams_acoeff', lambda: fetch_acoeffs(24409), shot=24409, camera='AMS')
 
-    acoeffs = client.get('AMS_ACOEFF', 24409).data
-    rpos = client.get('AMS_RPOS', 24409).data[0, :]
+    acoeffs = calibration['acoeff']
+    rpos = calibration['rpos'][0, :]
 
     ams_a0 = acoeffs[0, 0, :]
     ams_a1 = acoeffs[0, 1, :]
@@ -74,7 +85,7 @@ def calc_current(fname, eq):
 
     # calculate Bz from the polarisation angle and the toroidal field from the equilibrium - fix up a sign error from the equilibrium (plasma current was +ve, not -ve for this equilibrium)
 
-    Bz = (np.tan(-1 * polarisation_angle[0:36]) * ams_a5 - ams_a2) * bphi_new / (ams_a0 - np.tan(-1 * polarisation_angle[0:36]) * ams_a3)
+    Bz = bz_from_polarisation(polarisation_angle[0:36], ams_a0, ams_a2, ams_a3, ams_a5, bphi_new, sign=-1.)
 
     j_phi = np.gradient(Bz)/ np.gradient(gamma_dataset['r_coords'][0:36])
 
@@ -0,0 +1,154 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+from collections import namedtuple
+
+"""
+Local store for calibration data - polariser offset maps, carrier templates, A-coefficients etc. Each calibration is
+saved with the camera and optics configuration it belongs to and the range of shots it is valid for, so that a fit
+or a remote fetch only ever has to be done once.
+
+Calibrations are kept in an SQLite database (arrays are stored as .npz blobs), indexed on (kind, camera, optics).
+Lookups are also cached in memory.
+
+Example:
+
+    store = CalibrationStore()
+    acoeffs = store.get_or_compute('ams_acoeff', fetch_acoeffs, shot=24409, camera='AMS')
+
+Calibrations fitted from a bench measurement with no shot number can be keyed on the measurement itself with data_key,
+ie. optics={'FLC': True, 'data': data_key(images)}.
+"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.imse', 'calibration.sqlite')
+
+Calibration = namedtuple('Calibration', 'data attributes first_shot last_shot')
+
+def optics_key(optics):
+    """Optics configuration as a string, dictionaries of settings are written with sorted keys."""
+    if isinstance(optics, dict):
+        return json.dumps(optics, sort_keys=True)
+    return str(optics)
+
+def data_key(*arrays):
+    """Digest of the contents of arrays, so a calibration is reused for the same data rather than the same file name."""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update('{} {}'.format(array.dtype.str, array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def _to_bytes(data):
+    buffer = io.BytesIO()
+    np.savez(buffer, **data)
+    return buffer.getvalue()
+
+def _from_bytes(blob):
+    with np.load(io.BytesIO(blob)) as saved:
+        return {name: saved[name] for name in saved.files}
+
+class CalibrationStore(object):
+
+    def __init__(self, path=None):
+
+        self.path = DEFAULT_PATH if path is None else path
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS calibrations ("
+                                 "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, camera TEXT NOT NULL, "
+                                 "optics TEXT NOT NULL, first_shot INTEGER, last_shot INTEGER, created REAL, "
+                                 "attributes TEXT, data BLOB)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS lookup ON calibrations (kind, camera, optics)")
+        self._connection.commit()
+
+        self._cache = {}
+
+    def save(self, kind, data, camera='', optics='', first_shot=None, last_shot=None, **attributes):
+
+        """
+        :param kind: Type of calibration, ie. 'polariser_offset', 'ams_acoeff'.
+        :param data: Dictionary of arrays (or scalars) to store.
+        :param camera: Camera the calibration belongs to.
+        :param optics: Optics configuration, a string or a dictionary of settings.
+        :param first_shot: First shot the calibration is valid for, None if there is no lower limit.
+        :param last_shot: Last shot the calibration is valid for, None if there is no upper limit.
+        :param attributes: Any other information to keep with the calibration (must be JSON serialisable).
+        """
+
+        optics = optics_key(optics)
+
+        with self._connection:
+            self._connection.execute("INSERT INTO calibrations (kind, camera, optics, first_shot, last_shot, created, "
+                                     "attributes, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (kind, camera, optics, first_shot, last_shot, time.time(),
+                                      json.dumps(attributes), _to_bytes(data)))
+
+        #A new calibration may supersede cached lookups for the same configuration
+        for key in [key for key in self._cache if key[0] == kind and key[2:] == (camera, optics)]:
+            del self._cache[key]
+
+    def load(self, kind, shot=None, camera='', optics=''):
+
+        """
+        :param shot: Shot number to find a valid calibration for. If None, only calibrations without a shot range match.
+        :return: Calibration - the most recently saved calibration valid for the shot.
+        """
+
+        optics = optics_key(optics)
+        key = (kind, shot, camera, optics)
+
+        if key in self._cache:
+            return self._cache[key]
+
+        query = "SELECT data, attributes, first_shot, last_shot FROM calibrations WHERE kind = ? AND camera = ? AND optics = ? "
+
+        if shot is None:
+            query += "AND first_shot IS NULL AND last_shot IS NULL "
+            parameters = (kind, camera, optics)
+        else:
+            query += "AND (first_shot IS NULL OR first_shot <= ?) AND (last_shot IS NULL OR last_shot >= ?) "
+            parameters = (kind, camera, optics, int(shot), int(shot))
+
+        row = self._connection.execute(query + "ORDER BY created DESC LIMIT 1", parameters).fetchone()
+
+        if row is None:
+            raise KeyError("No {} calibration for shot {}, camera '{}', optics '{}'".format(kind, shot, camera, optics))
+
+        calibration = Calibration(_from_bytes(row[0]), json.loads(row[1]), row[2], row[3])
+        self._cache[key] = calibration
+
+        return calibration
+
+    def get_or_compute(self, kind, compute, shot=None, camera='', optics='', first_shot=None, last_shot=None):
+
+        """
+        Load a calibration, or calculate it with compute() and save it if there isn't one.
+        :param compute: Function taking no arguments that returns the calibration data as a dictionary.
+        :param first_shot, last_shot: Validity range to save a new calibration with, defaults to just this shot.
+        :return: Dictionary of calibration data.
+        """
+
+        try:
+            return self.load(kind, shot=shot, camera=camera, optics=optics).data
+        except KeyError:
+            pass
+
+        if shot is not None:
+            first_shot = shot if first_shot is None else first_shot
+            last_shot = shot if last_shot is None else last_shot
+
+        self.save(kind, compute(), camera=camera, optics=optics, first_shot=first_shot, last_shot=last_shot)
+
+        return self.load(kind, shot=shot, camera=camera, optics=optics).data
+
+    def close(self):
+        self._connection.close()
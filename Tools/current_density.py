@@ -0,0 +1,183 @@
+import numpy as np
+from collections import namedtuple
+from IMSE.Model.Constants import Constants
+
+"""
+Bz, Br and toroidal current density from IMSE polarisation angle maps, calculated in strips of rows.
+
+Bz comes from the polarisation angle, the geometry (A) coefficients and the toroidal field,
+
+    Bz = (tan(gamma) A5 - A2) Bphi / (A0 - tan(gamma) A3),
+
+and j_phi = (dBr/dZ - dBz/dR) / mu_0. Maps are (nz, nr), rows along Z and columns along R. Each strip of rows is
+read with one extra row either side (the halo) for the Z derivative, so the result is the same as taking
+np.gradient of the full map, but the temporaries are only the size of a strip. The fields are calculated in float32
+unless another dtype is given, the grid spacing is always float64 as the rows of a fine grid can be close together.
+
+Example:
+
+    result = reconstruct(gamma, a0, a2, a3, a5, Bphi, new_r, new_z, Br=Br)
+    plt.pcolormesh(new_r, new_z, result.j_phi)
+
+    for frame in reconstruct_frames(gamma_frames, a0, a2, a3, a5, Bphi, new_r, new_z):
+        ...
+"""
+
+constant = Constants()
+
+Reconstruction = namedtuple('Reconstruction', 'Bz Br j_phi')
+
+def bz_from_polarisation(gamma, a0, a2, a3, a5, Bphi, sign=-1.):
+
+    """
+    :param gamma: Polarisation angle in radians (Array - any shape).
+    :param a0, a2, a3, a5: Geometry coefficients, broadcast with gamma.
+    :param Bphi: Toroidal field, broadcast with gamma.
+    :param sign: Multiplies gamma before taking tan, -1 for the sign convention of the MAST-U equilibria used with
+                 MSESIM (the plasma current in them is positive rather than negative).
+    :return: Bz, in the units of Bphi.
+    """
+
+    tan_gamma = np.tan(sign * gamma)
+
+    return (tan_gamma * a5 - a2) * Bphi / (a0 - tan_gamma * a3)
+
+def _strips(n_rows, tile_rows):
+
+    """
+    :return: For each strip, the rows to read including the halo, the rows of the strip within those, and the rows
+             of the strip in the full map.
+    """
+
+    for start in range(0, n_rows, tile_rows):
+        stop = min(start + tile_rows, n_rows)
+        first, last = max(start - 1, 0), min(stop + 1, n_rows)
+        yield slice(first, last), slice(start - first, stop - first), slice(start, stop)
+
+def _is_function(values):
+    return callable(values) or (isinstance(values, tuple) and len(values) == 2 and callable(values[0]))
+
+def _rows(values, rows, R, Z, dtype):
+
+    """
+    Rows of a map (Array - nz, nr), of a profile across R repeated on every row (Array - nr) or of a function of
+    (R, Z) evaluated on the rows. A function returning several fields is given as (function, field name), ie.
+    (eq.evaluate_points, 'Bt').
+    """
+
+    if values is None:
+        return None
+
+    if _is_function(values):
+        RR, ZZ = np.meshgrid(R, Z[rows])
+        if callable(values):
+            return np.asarray(values(RR, ZZ), dtype=dtype)
+        function, name = values
+        return np.asarray(getattr(function(RR, ZZ), name), dtype=dtype)
+
+    values = np.asarray(values)
+    if values.ndim == 2 and values.shape[0] == len(Z):
+        values = values[rows]
+
+    return values.astype(dtype, copy=False)
+
+def _evaluate(values, R, Z, dtype):
+    #Functions are evaluated once on the full grid, ie. to use the same field for every frame
+    return _rows(values, slice(None), R, Z, dtype) if _is_function(values) else values
+
+def _current(Bz, Br, R, Z, interior, out):
+
+    """
+    j_phi of one strip, written into out.
+    :param Bz: Bz of the strip (Array - n_rows, nr).
+    :param Br: Br of the strip and its halo (Array - n_rows + halo, nr), or None to leave out dBr/dZ.
+    :param Z: Z of the strip and its halo.
+    """
+
+    np.negative(np.gradient(Bz, R, axis=1), out=out)
+
+    if Br is not None:
+        Br = np.broadcast_to(Br, (len(Z), len(R)))
+        out += np.gradient(Br, Z, axis=0)[interior]
+
+    out /= constant.mu_0
+
+def current_density(Bz, R, Z, Br=None, tile_rows=128, dtype=np.float32):
+
+    """
+    :param Bz: Bz map in T (Array - nz, nr).
+    :param R: Major radius of the columns in m (Array - nr).
+    :param Z: Height of the rows in m (Array - nz).
+    :param Br: Br in T, a map (Array - nz, nr), a profile across R (Array - nr), a function of (R, Z) returning one
+               array, or (function, field name) for a function returning several, ie. (eq.evaluate_points, 'BR').
+               If None only the dBz/dR term is included.
+    :param tile_rows: Number of rows calculated at a time.
+    :param dtype: Type of the calculation and of the result.
+    :return: Toroidal current density in A/m^2 (Array - nz, nr).
+    """
+
+    R = np.asarray(R, dtype=np.float64)
+    Z = np.asarray(Z, dtype=np.float64)
+
+    j_phi = np.empty((len(Z), len(R)), dtype=dtype)
+
+    for rows, interior, out_rows in _strips(len(Z), tile_rows):
+        _current(_rows(Bz, out_rows, R, Z, dtype), _rows(Br, rows, R, Z, dtype), R, Z[rows], interior, j_phi[out_rows])
+
+    return j_phi
+
+def reconstruct(gamma, a0, a2, a3, a5, Bphi, R, Z, Br=None, sign=-1., tile_rows=128, dtype=np.float32):
+
+    """
+    :param gamma: Polarisation angle map in radians (Array - nz, nr).
+    :param a0, a2, a3, a5: Geometry coefficients, maps (Array - nz, nr), profiles across R (Array - nr) or scalars.
+    :param Bphi: Toroidal field in T, a map, a profile across R, a function of (R, Z) returning one array, or
+                 (function, field name), ie. (eq.evaluate_points, 'Bt').
+    :param R: Major radius of the columns in m (Array - nr).
+    :param Z: Height of the rows in m (Array - nz).
+    :param Br: Br in T, given in the same ways as Bphi, ie. (eq.evaluate_points, 'BR'). If None only the dBz/dR term
+               is included in j_phi.
+    :param sign: Sign convention of gamma, see bz_from_polarisation.
+    :param tile_rows: Number of rows calculated at a time.
+    :param dtype: Type of the calculation and of the result.
+    :return: Reconstruction of Bz and Br in T and j_phi in A/m^2 (Array - nz, nr). Br is None if it was not given.
+    """
+
+    R = np.asarray(R, dtype=np.float64)
+    Z = np.asarray(Z, dtype=np.float64)
+    shape = (len(Z), len(R))
+
+    Bz = np.empty(shape, dtype=dtype)
+    j_phi = np.empty(shape, dtype=dtype)
+    Br_map = None if Br is None else np.empty(shape, dtype=dtype)
+
+    for rows, interior, out_rows in _strips(len(Z), tile_rows):
+
+        coefficients = [_rows(a, out_rows, R, Z, dtype) for a in (a0, a2, a3, a5)]
+        Bz[out_rows] = bz_from_polarisation(_rows(gamma, out_rows, R, Z, dtype), *coefficients,
+                                            Bphi=_rows(Bphi, out_rows, R, Z, dtype), sign=sign)
+
+        Br_rows = _rows(Br, rows, R, Z, dtype)
+        if Br_rows is not None:
+            Br_map[out_rows] = np.broadcast_to(Br_rows, (rows.stop - rows.start, len(R)))[interior]
+
+        _current(Bz[out_rows], Br_rows, R, Z[rows], interior, j_phi[out_rows])
+
+    return Reconstruction(Bz, Br_map, j_phi)
+
+def reconstruct_frames(gammas, a0, a2, a3, a5, Bphi, R, Z, Br=None, sign=-1., tile_rows=128, dtype=np.float32):
+
+    """
+    Reconstruct a sequence of polarisation angle maps one frame at a time.
+    :param gammas: Polarisation angle maps (Iterable of Array - nz, nr), ie. a stack of frames or a generator that
+                   demodulates them as they are read.
+    :return: Generator of the Reconstruction of each frame, see reconstruct for the other arguments.
+    """
+
+    R = np.asarray(R, dtype=np.float64)
+    Z = np.asarray(Z, dtype=np.float64)
+    Bphi = _evaluate(Bphi, R, Z, dtype)
+    Br = _evaluate(Br, R, Z, dtype)
+
+    for gamma in gammas:
+        yield reconstruct(gamma, a0, a2, a3, a5, Bphi, R, Z, Br=Br, sign=sign, tile_rows=tile_rows, dtype=dtype)
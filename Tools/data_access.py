@@ -0,0 +1,195 @@
+import os
+import threading
+import numpy as np
+from collections import namedtuple
+
+"""
+Access to machine data (pyuda / IDAM signals such as AMS_ACOEFF or efm_psi(r,z)) through a pluggable backend.
+
+Every backend has a get(name, shot) method returning a Signal. Signals fetched from a remote backend can be recorded
+in a local shot cache (one compressed HDF5 file per shot), so repeated analyses of the same shot make no remote calls.
+The same cache files can be read with no network at all using OfflineClient.
+
+Example:
+
+    client = get_client('uda')
+    acoeffs = client.get('AMS_ACOEFF', 24409).data
+
+    client = get_client('offline')    # only what has been cached before
+"""
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.imse', 'shots')
+
+Signal = namedtuple('Signal', 'data time units')
+
+def _as_signal(result):
+
+    """Convert a pyuda or idam result to a Signal. pyuda gives the time as a dimension object, idam as an array."""
+
+    time = getattr(result, 'time', None)
+    if time is not None and hasattr(time, 'data'):
+        time = time.data
+
+    units = getattr(result, 'units', '')
+
+    return Signal(np.asarray(result.data), None if time is None else np.asarray(time), '' if units is None else str(units))
+
+class UDABackend(object):
+
+    def __init__(self):
+
+        try:
+            import pyuda
+        except:
+            raise ImportError("No pyuda module found, cannot load remote data")
+
+        self._client = pyuda.Client()
+
+    def get(self, name, shot):
+        return _as_signal(self._client.get(name, shot))
+
+class IDAMBackend(object):
+
+    def __init__(self, host="idam1"):
+
+        try:
+            import idam
+            idam.setHost(host)
+        except:
+            raise ImportError("No Idam module found, cannot load remote data")
+
+        self._idam = idam
+
+    def get(self, name, shot):
+        return _as_signal(self._idam.Data(name, shot))
+
+class ShotCache(object):
+
+    """
+    Local on-disk cache of signals, <cache_dir>/<shot>.h5 with a group per signal holding data, time and units.
+
+    :param backend: Backend to fetch signals missing from the cache, or None to only read the cache.
+    :param cache_dir: Directory of the cache files, defaults to ~/.imse/shots.
+    :param compression: HDF5 compression filter for the data and time arrays.
+    """
+
+    def __init__(self, backend=None, cache_dir=None, compression='gzip'):
+
+        try:
+            import h5py
+        except:
+            raise ImportError("No h5py module found, cannot use the shot cache")
+
+        self._h5py = h5py
+        self.backend = backend
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        self.compression = compression
+        self.remote_calls = 0
+
+        #h5py does not allow the same file to be written from several threads at once
+        self._lock = threading.Lock()
+
+    def filename(self, shot):
+        return os.path.join(self.cache_dir, '{}.h5'.format(int(shot)))
+
+    @staticmethod
+    def key(name):
+        #Signal names are not case sensitive, '/' would start a new HDF5 group
+        return name.lower().replace('/', '|')
+
+    def read(self, name, shot):
+
+        """
+        :return: The cached Signal, or None if the signal has not been cached for this shot.
+        """
+
+        filename = self.filename(shot)
+
+        with self._lock:
+            if not os.path.exists(filename):
+                return None
+
+            with self._h5py.File(filename, 'r') as cache:
+                if self.key(name) not in cache:
+                    return None
+
+                group = cache[self.key(name)]
+                time = group['time'][()] if 'time' in group else None
+
+                return Signal(group['data'][()], time, group.attrs['units'])
+
+    def write(self, name, shot, signal):
+
+        #Several threads may fill a new cache at once
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with self._lock:
+            with self._h5py.File(self.filename(shot), 'a') as cache:
+                if self.key(name) in cache:
+                    del cache[self.key(name)]
+
+                group = cache.create_group(self.key(name))
+                group.attrs['name'] = name
+                group.attrs['units'] = '' if signal.units is None else str(signal.units)
+
+                for field in ('data', 'time'):
+                    values = getattr(signal, field)
+                    if values is None:
+                        continue
+                    values = np.asarray(values)
+                    #Scalars can't be chunked, so can't be compressed
+                    group.create_dataset(field, data=values, compression=self.compression if values.ndim else None)
+
+    def get(self, name, shot):
+
+        signal = self.read(name, shot)
+
+        if signal is None:
+            if self.backend is None:
+                raise KeyError("{} for shot {} is not in the shot cache {}".format(name, shot, self.cache_dir))
+
+            signal = self.backend.get(name, shot)
+            self.remote_calls += 1
+            self.write(name, shot, signal)
+
+        return signal
+
+class OfflineClient(ShotCache):
+
+    """Stand-in for a remote client with no network, serving only signals already in the shot cache."""
+
+    def __init__(self, cache_dir=None):
+        super(OfflineClient, self).__init__(backend=None, cache_dir=cache_dir)
+
+BACKENDS = {'uda': UDABackend,
+            'idam': IDAMBackend}
+
+def get_client(backend='uda', cache=None, cache_dir=None):
+
+    """
+    :param backend: 'uda', 'idam' or 'offline', or a backend object with a get(name, shot) method.
+    :param cache: True to record signals in the shot cache, False to always fetch them. If None the cache is used
+                  when h5py is available.
+    :param cache_dir: Directory of the shot cache.
+    :return: Client with a get(name, shot) method returning a Signal.
+    """
+
+    if backend == 'offline':
+        return OfflineClient(cache_dir=cache_dir)
+
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise ValueError("Unrecognised backend {}, choose one of {}".format(backend, list(BACKENDS) + ['offline']))
+        backend = BACKENDS[backend]()
+
+    if cache is None:
+        try:
+            import h5py
+            cache = True
+        except ImportError:
+            cache = False
+
+    if cache:
+        return ShotCache(backend, cache_dir=cache_dir)
+
+    return backend
@@ -0,0 +1,152 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from Tools.synthetic_spectrum import image_plane_basis, beam_closest_approach
+from Tools.current_density import bz_from_polarisation
+
+"""
+Geometry (A) coefficients of every IMSE pixel from the viewing geometry, rather than interpolating the six
+AMS_ACOEFF values of the conventional MSE channels.
+
+The pi light is polarised along E = v x B, so the polarisation angle measured from the horizontal of the image is
+
+    tan(gamma) = (A0 Bz + A1 BR + A2 Bphi) / (A3 Bz + A4 BR + A5 Bphi),
+
+with A0..A2 = (w x v).(Z, R, phi) and A3..A5 = (u x v).(Z, R, phi) at the emission point, where v is the beam
+direction and u, w the horizontal and vertical unit vectors of the image plane (synthetic_spectrum.image_plane_basis,
+so the coefficients match the synthetic spectra). Coefficients are calculated for all pixels at once and kept for each
+optical configuration (lens, beam and emission points), so inverting a full frame for Bz is a single array expression.
+
+Example:
+
+    coefficients = from_msesim(msesim)
+    Bz = invert_bz(gamma, coefficients, Bphi)
+"""
+
+cache_size = 8
+_coefficients = OrderedDict()
+
+def _key(*arrays):
+    #Configurations are identified by the bytes of their arrays, with the shapes so reshaped arrays don't match
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def geometry_coefficients(lens_position, beam_axis, points, weights=None, up=(0., 0., 1.)):
+
+    """
+    :param lens_position: Position of the collection lens in m (Array - 3).
+    :param beam_axis: Direction of the beam (Array - 3).
+    :param points: Emission points in m (Array - ..., 3), ie. the MSESIM grid coordinates.
+    :param weights: Emission at each point (Array - ..., n_samples). If given, points are sampled along each line of
+                    sight (Array - ..., n_samples, 3) and the coefficients are the emission weighted average over them.
+    :param up: Direction that is vertical in the image.
+    :return: A0-A5 (Array - 6, ...), read only.
+    """
+
+    key = _key(lens_position, beam_axis, points, [] if weights is None else weights, up)
+
+    if key in _coefficients:
+        _coefficients.move_to_end(key)
+        return _coefficients[key]
+
+    points = np.asarray(points, dtype=np.float64)
+    beam_axis = np.asarray(beam_axis, dtype=np.float64)
+    beam_axis = beam_axis / np.linalg.norm(beam_axis)
+
+    sight = points - np.asarray(lens_position, dtype=np.float64)
+    sight /= np.linalg.norm(sight, axis=-1, keepdims=True)
+    horizontal, vertical = image_plane_basis(sight, up)
+
+    #Unit vectors Z, R, phi at each point (Array - 3, ..., 3)
+    R = np.hypot(points[..., 0], points[..., 1])
+    zeros = np.zeros_like(R)
+    directions = np.stack([np.stack([zeros, zeros, zeros + 1.], axis=-1),
+                           np.stack([points[..., 0] / R, points[..., 1] / R, zeros], axis=-1),
+                           np.stack([-points[..., 1] / R, points[..., 0] / R, zeros], axis=-1)])
+
+    coefficients = np.concatenate([np.sum(np.cross(vertical, beam_axis) * directions, axis=-1),
+                                   np.sum(np.cross(horizontal, beam_axis) * directions, axis=-1)])
+
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        coefficients = np.sum(coefficients * weights, axis=-1) / np.sum(weights, axis=-1)
+
+    coefficients.setflags(write=False)
+
+    _coefficients[key] = coefficients
+    while len(_coefficients) > cache_size:
+        _coefficients.popitem(last=False)
+
+    return coefficients
+
+def pixel_coefficients(lens_position, directions, beam_position, beam_axis, up=(0., 0., 1.)):
+
+    """
+    Coefficients of pixels with no MSESIM channel, taking the emission to come from the closest approach of each line
+    of sight to the beam axis.
+    :param directions: Unit vectors from the lens along the line of sight of each pixel (Array - ..., 3), ie. from
+                       synthetic_spectrum.lens_rays.
+    :param beam_position: Any point on the beam axis in m, ie. the duct coordinates (Array - 3).
+    :return: A0-A5 (Array - 6, ...).
+    """
+
+    lens_position = np.asarray(lens_position, dtype=np.float64)
+    directions = np.asarray(directions, dtype=np.float64)
+    beam_axis = np.asarray(beam_axis, dtype=np.float64) / np.linalg.norm(beam_axis)
+
+    distance = beam_closest_approach(lens_position, directions, np.asarray(beam_position, dtype=np.float64), beam_axis)
+    points = lens_position + distance[..., np.newaxis] * directions
+
+    return geometry_coefficients(lens_position, beam_axis, points, up=up)
+
+def from_msesim(msesim, weighted=True, up=(0., 0., 1.)):
+
+    """
+    :param msesim: MSESIM run (Tools.load_msesim.MSESIM).
+    :param weighted: Average over the grid points of each channel weighted by their emission. If False the central
+                     coordinates of each channel are used.
+    :return: A0-A5 (Array - 6, n_channels), or (Array - 6, ny, nx) for a 2D run.
+    """
+
+    n_channels = len(msesim.channels)
+
+    if weighted:
+        points = np.asarray(msesim.grid_coordinates, dtype=np.float64).reshape(n_channels, -1, 3)
+        weights = np.asarray(msesim.data['emission_intensity'], dtype=np.float64).reshape(n_channels, -1)
+    else:
+        points = np.asarray(msesim.central_coordinates, dtype=np.float64).reshape(n_channels, 3)
+        weights = None
+
+    coefficients = geometry_coefficients(np.ravel(msesim.collection_lens), np.ravel(msesim.beam_axis_vector), points,
+                                         weights=weights, up=up)
+
+    if msesim.dimension == 2:
+        side = int(np.sqrt(n_channels))
+        coefficients = coefficients.reshape(6, side, side)
+
+    return coefficients
+
+def invert_bz(gamma, coefficients, Bphi, BR=None, sign=1.):
+
+    """
+    :param gamma: Polarisation angle in radians (Array - ...).
+    :param coefficients: A0-A5 (Array - 6, ...) broadcast with gamma.
+    :param Bphi: Toroidal field, broadcast with gamma.
+    :param BR: Radial field, if None the A1 and A4 terms are left out.
+    :param sign: Multiplies gamma before taking tan. 1 for angles in the convention of these coefficients, -1 for
+                 the MAST-U equilibria used with MSESIM (see current_density.bz_from_polarisation).
+    :return: Bz, in the units of Bphi.
+    """
+
+    a0, a1, a2, a3, a4, a5 = coefficients
+
+    if BR is None:
+        return bz_from_polarisation(gamma, a0, a2, a3, a5, Bphi, sign=sign)
+
+    tan_gamma = np.tan(sign * gamma)
+
+    return (tan_gamma * (a4 * BR + a5 * Bphi) - a1 * BR - a2 * Bphi) / (a0 - tan_gamma * a3)
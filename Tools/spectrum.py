@@ -1,101 +1,13 @@
-from raysect.core import Point3D, Vector3D, translate, rotate_basis
+from raysect.core import Point3D
 import numpy as np
 from IMSE.Model.Constants import Constants
 import matplotlib.pyplot as plt
 from IMSE.Tools.Plotting.graph_format import plot_format
+from IMSE.Tools.stark_spectrum import stark_spectrum, line_spectrum
 
 cb = plot_format()
 constant = Constants()
 
-def calculate_doppler_shift(beam_duct, beam_span, lens_pos, beam_velocity):
-
-    emission_vectors = []
-    sample_points = []
-    doppler_shift = []
-
-    #Calculate the beam vector
-    beam_vector = beam_source.vector_to(beam_duct).normalise()
-
-    #Sample some points along the beam, calculate the vector to the lens for each point,
-    #Calculate the Doppler shift at each position
-
-    for i, point in enumerate(beam_span):
-        sample = beam_duct + beam_vector * point
-        emission_vector = sample.vector_to(lens_pos).normalise()
-
-        wavelength_shift = rest_wavelength - (lambda_vacuum/constant.c) * beam_velocity * beam_vector.dot(emission_vector)
-
-        emission_vectors.append(emission_vector)
-        sample_points.append(sample)
-        doppler_shift.append(wavelength_shift)
-
-    return beam_vector, emission_vectors, sample_points, doppler_shift
-
-def calculate_Efield(sample_points, beam_velocity, beam_vector):
-
-    sr = []
-    sphi = []
-    sz = []
-
-    phi_hat = Vector3D(0, 1, 0)
-    E = []
-    E_vectors = []
-
-    for i, point in enumerate(sample_points):
-
-        sr = np.sqrt(point.x**2 + point.y**2)
-        sphi = np.arctan(point.y/point.x)
-        sz = point.z
-
-        Bt = 1 / sr
-        B = Vector3D(np.sin(sphi), np.cos(sphi), 0)
-
-        E_vector = beam_velocity * beam_vector.cross(B)
-        E_vectors.append(E_vector)
-
-        E_mag = np.sqrt(E_vector.dot(E_vector))
-        E.append(E_mag)
-
-    return E, E_vectors
-
-def calculate_line_intensities(E, E_vectors, emission_vectors, doppler_shift):
-
-    #Given weights of the intensities of each pi and sigma transition
-
-    r0 = 0.28
-    r1 = 0.11
-    r2 = 0.04
-    r3 = 0.12
-    r4 = 0.09
-
-    m = np.array([-4, -3, -2, -1, 0, 1, 2, 3, 4])
-
-    transition_weights = np.array([-r4, -r3, -r2, r1, r0, r1, -r2, -r3, -r4])
-
-    I_polarised = np.zeros((len(transition_weights), len(emission_vectors)))
-    I_unpolarised = np.zeros((len(transition_weights), len(emission_vectors)))
-    stark_wavelength = np.zeros((len(transition_weights), len(emission_vectors)))
-
-    for i, E in enumerate(E_vectors):
-
-        stark_shift = m * 2.77 * 10 ** -7 * E.z * (10 ** -10)
-
-        print('stark shift', stark_shift, 'doppler shift', doppler_shift[i])
-
-        stark_wavelength[:,i] = stark_shift + doppler_shift[i]
-
-        I_polarised[:,i] = (1 - ((E.dot(emission_vectors[i]))**2 / E.dot(E))) * transition_weights
-
-        I_unpolarised[:,i] = 2 * (E.dot(emission_vectors[i]))**2/ E.dot(E) * abs(transition_weights)
-
-        I_unpolarised[0:3,i] = 0
-        I_unpolarised[6:-1,i] = 0
-
-    return I_polarised, I_unpolarised, stark_wavelength
-
-def gaussian(x, mu, a, sig):
-    return a*(np.exp(-np.power(x - mu, 2.) / (2 * np.power(sig, 2.))))
-
 def plot_spectrum(stark_wavelength, I_polarised, stark_wavelength2, I_polarised2, stark_wavelength3, I_polarised3):
 
     wavelengths = np.arange(655,663,0.01)
@@ -157,33 +69,27 @@ def plot_spectrum(stark_wavelength, I_polarised, stark_wavelength2, I_polarised2
     plt.xlabel('Wavelength (nm)')
 
 
-    for m, mean in enumerate(pi_mu):
-        plt.plot(wavelengths, gaussian(wavelengths, mean, intensity[m], sd), color='black')
-        plt.fill(wavelengths, gaussian(wavelengths, mean, intensity[m], sd), alpha=0.55, color=cb[3])
-
-    for m2, mean2 in enumerate(pi_mu_half):
-        plt.plot(wavelengths, gaussian(wavelengths, mean2, intensity[m2], pi_sd_half), color='black')
-        plt.fill(wavelengths, gaussian(wavelengths, mean2, intensity[m2], pi_sd_half), alpha=0.55, color=cb[3])
-
-    for m3, mean3 in enumerate(pi_mu_third):
-        plt.plot(wavelengths, gaussian(wavelengths, mean3, intensity[m3], pi_sd_third), color='black')
-        plt.fill(wavelengths, gaussian(wavelengths, mean3, intensity[m3], pi_sd_third), alpha=0.55, color=cb[3])
+    #The lines of each energy component share a width, so each component is synthesised with one call. Every line
+    #is kept in its own row to be filled separately, with the peak heights converted to integrated intensities.
+    components = [(pi_mu, sigma_mu, sd), (pi_mu_half, sigma_mu_half, pi_sd_half[0]),
+                  (pi_mu_third, sigma_mu_third, pi_sd_third[0])]
 
-    plt.plot(wavelengths, gaussian(wavelengths, sigma_mu, sigma_intensity, sd), color='black')
-    plt.fill(wavelengths, gaussian(wavelengths, sigma_mu, sigma_intensity, sd), alpha=0.55, color=cb[0])
+    for pi_centres, sigma_centres, width in components:
+        centres = np.array(pi_centres + sigma_centres)[:, np.newaxis]
+        peaks = np.array(intensity[:len(pi_centres)] + sigma_intensity * len(sigma_centres))[:, np.newaxis]
+        profiles = line_spectrum(centres, peaks * width * np.sqrt(2 * np.pi), wavelengths, width)
+        colours = [cb[3]] * len(pi_centres) + [cb[0]] * len(sigma_centres)
 
-    plt.plot(wavelengths, gaussian(wavelengths, sigma_mu_half, sigma_intensity, sigma_sd_half), color='black')
-    plt.fill(wavelengths, gaussian(wavelengths, sigma_mu_half, sigma_intensity, sigma_sd_half), alpha=0.55, color=cb[0])
-
-
-    plt.plot(wavelengths, gaussian(wavelengths, sigma_mu_third, sigma_intensity, sigma_sd_third), color='black')
-    plt.fill(wavelengths, gaussian(wavelengths, sigma_mu_third, sigma_intensity, sigma_sd_third), alpha=0.55, color=cb[0])
+        for profile, colour in zip(profiles, colours):
+            plt.plot(wavelengths, profile, color='black')
+            plt.fill(wavelengths, profile, alpha=0.55, color=colour)
 
     textstr = '$D_{\\alpha}$'
     plt.annotate(textstr, xy=(655.8, 0.489), fontsize=28, color='black')
-    plt.plot(wavelengths, gaussian(wavelengths, dalpha_mu, [0.5], dalpha_sd), color='black')
+    dalpha = line_spectrum([dalpha_mu], [0.5 * dalpha_sd * np.sqrt(2 * np.pi)], wavelengths, dalpha_sd)
+    plt.plot(wavelengths, dalpha, color='black')
 
-    plt.fill(wavelengths, gaussian(wavelengths, dalpha_mu, [0.5], dalpha_sd), color='gray', alpha=0.5)
+    plt.fill(wavelengths, dalpha, color='gray', alpha=0.5)
 
     plt.show()
 
@@ -224,21 +130,14 @@ Rt = 0.6736
 #Define some points along the beam from the duct to the tangency radius
 beam_span = np.linspace(Rt,R_duct,100)
 
-#first energy component
-beam_vector, emission_vectors, sample_points, doppler_shift = calculate_doppler_shift(beam_duct, beam_span, lens_pos, beam_velocity)
-E, E_vectors = calculate_Efield(sample_points, beam_velocity, beam_vector)
-I_polarised, I_unpolarised, stark_wavelength = calculate_line_intensities(E, E_vectors, emission_vectors, doppler_shift)
-
-#second energy component
-beam_vector2, emission_vectors2, sample_points2, doppler_shift2 = calculate_doppler_shift(beam_duct, beam_span, lens_pos, beam_velocity/2)
-E2, E_vectors2 = calculate_Efield(sample_points2, beam_velocity/2, beam_vector2)
-I_polarised2, I_unpolarised2, stark_wavelength2 = calculate_line_intensities(E2, E_vectors2, emission_vectors2, doppler_shift2)
-
-#third energy
-beam_vector3, emission_vectors3, sample_points3, doppler_shift3 = calculate_doppler_shift(beam_duct, beam_span, lens_pos, beam_velocity/3)
-E3, E_vectors3 = calculate_Efield(sample_points3, beam_velocity/3, beam_vector3)
-I_polarised3, I_unpolarised3, stark_wavelength3 = calculate_line_intensities(E3, E_vectors3, emission_vectors3, doppler_shift3)
+#All three energy components (E, E/2, E/3) at once, indexed along the first axis
+spectrum = stark_spectrum(np.array([beam_source.x, beam_source.y, beam_source.z]),
+                          np.array([beam_duct.x, beam_duct.y, beam_duct.z]), beam_span,
+                          np.array([lens_pos.x, lens_pos.y, lens_pos.z]), beam_velocity)
 
+stark_wavelength, stark_wavelength2, stark_wavelength3 = spectrum['stark_wavelength']
+I_polarised, I_polarised2, I_polarised3 = spectrum['I_polarised']
+I_unpolarised, I_unpolarised2, I_unpolarised3 = spectrum['I_unpolarised']
 
 plot_spectrum(stark_wavelength, I_polarised, stark_wavelength2, I_polarised2, stark_wavelength3, I_polarised3)
 
@@ -0,0 +1,207 @@
+import numpy as np
+from IMSE.Model.Constants import Constants
+
+#Motional Stark spectrum of the beam emission, calculated with arrays rather than a loop over sample points.
+
+#Positions and vectors are arrays with the x, y, z components along the last axis. Beam velocities may be a single
+#value or an array of energy components (v, v/sqrt(2), v/sqrt(3) for the E, E/2 and E/3 components, see
+#component_velocities), which is broadcast against the beam sample points, so every result has the shape
+#(n_energies, ..., n_points), or (..., n_points) for a single velocity. Any number of lines of sight can be modelled at
+#once by stacking their sample points.
+
+constant = Constants()
+
+#Balmer alpha transition n=3 to n=2, rest wavelength in m and the vacuum wavelength from the Rydberg formula
+rest_wavelength = 656.1 * 10**-9
+rydberg_constant = constant.rydberg/(1 + constant.mass_e/constant.mass_p)
+lambda_vacuum = 1./(rydberg_constant*(1/2.0**2 - 1/3.0**2))
+
+#Stark shift of each component in m per V/m and per unit of m
+stark_coefficient = 2.77 * 10**-17
+
+#Relative intensities of the sigma (|m| <= 1) and pi (|m| = 2, 3, 4) transitions, pi weights are negative
+m = np.array([-4, -3, -2, -1, 0, 1, 2, 3, 4])
+
+r0 = 0.28
+r1 = 0.11
+r2 = 0.04
+r3 = 0.12
+r4 = 0.09
+
+transition_weights = np.array([-r4, -r3, -r2, r1, r0, r1, -r2, -r3, -r4])
+
+def component_velocities(beam_velocity, energy_fractions=(1., 1./2, 1./3)):
+
+    """
+    :param beam_velocity: Velocity of the full energy component in m/s.
+    :param energy_fractions: Energies of the beam components as fractions of the full energy, (1, 1/2, 1/3) for the
+                             E, E/2 and E/3 components.
+    :return: Velocity of each component in m/s (Array - n_energies), the velocity goes as the square root of energy.
+    """
+
+    return beam_velocity * np.sqrt(np.asarray(energy_fractions, dtype=np.float64))
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def beam_sample_points(beam_source, beam_duct, beam_span):
+
+    """
+    :param beam_source: Position of the PINI grid (Array - 3).
+    :param beam_duct: Position of the beam duct (Array - 3).
+    :param beam_span: Distances along the beam from the duct to sample at (Array - n_points).
+    :return: Unit vector along the beam (Array - 3) and the sample points (Array - n_points, 3).
+    """
+
+    beam_duct = np.asarray(beam_duct, dtype=np.float64)
+    beam_vector = _normalise(beam_duct - np.asarray(beam_source, dtype=np.float64))
+
+    sample_points = beam_duct + np.asarray(beam_span, dtype=np.float64)[:, np.newaxis] * beam_vector
+
+    return beam_vector, sample_points
+
+def calculate_doppler_shift(sample_points, beam_vector, lens_pos, beam_velocity):
+
+    """
+    :param sample_points: Positions along the beam (Array - ..., n_points, 3).
+    :param beam_vector: Unit vector along the beam (Array - 3).
+    :param lens_pos: Position of the collection lens (Array - 3).
+    :param beam_velocity: Beam velocity in m/s, a single value or one per energy component (Array - n_energies).
+    :return: Unit vectors from the sample points to the lens (Array - ..., n_points, 3) and the Doppler shifted
+             wavelength in m (Array - n_energies, ..., n_points).
+    """
+
+    emission_vectors = _normalise(np.asarray(lens_pos, dtype=np.float64) - sample_points)
+    cos_angle = emission_vectors @ np.asarray(beam_vector, dtype=np.float64)
+
+    doppler_shift = rest_wavelength - (lambda_vacuum/constant.c) * np.multiply.outer(beam_velocity, cos_angle)
+
+    return emission_vectors, doppler_shift
+
+def calculate_Efield(sample_points, beam_velocity, beam_vector):
+
+    """
+    Motional electric field v x B for a unit toroidal field, B = (sin(phi), cos(phi), 0).
+    :param sample_points: Positions along the beam (Array - ..., n_points, 3).
+    :param beam_velocity: Beam velocity in m/s, a single value or one per energy component (Array - n_energies).
+    :param beam_vector: Unit vector along the beam (Array - 3).
+    :return: Magnitude of the E field (Array - n_energies, ..., n_points) and the E field vectors
+             (Array - n_energies, ..., n_points, 3).
+    """
+
+    sample_points = np.asarray(sample_points, dtype=np.float64)
+
+    with np.errstate(divide='ignore'):
+        sphi = np.arctan(sample_points[..., 1]/sample_points[..., 0])
+
+    B = np.stack([np.sin(sphi), np.cos(sphi), np.zeros_like(sphi)], axis=-1)
+
+    E_vectors = np.multiply.outer(beam_velocity, np.cross(beam_vector, B))
+    E = np.linalg.norm(E_vectors, axis=-1)
+
+    return E, E_vectors
+
+def calculate_line_intensities(E_vectors, emission_vectors, doppler_shift):
+
+    """
+    :param E_vectors: E field vectors (Array - n_energies, ..., n_points, 3).
+    :param emission_vectors: Unit vectors from the sample points to the lens (Array - ..., n_points, 3).
+    :param doppler_shift: Doppler shifted wavelength in m (Array - n_energies, ..., n_points).
+    :return: Polarised and unpolarised intensity and the wavelength in m of the nine Stark components
+             (Array - n_energies, ..., 9, n_points).
+    """
+
+    E_vectors = np.asarray(E_vectors, dtype=np.float64)
+
+    #Squared cosine of the angle between the E field and the line of sight
+    cos_squared = np.sum(E_vectors * emission_vectors, axis=-1)**2 / np.sum(E_vectors**2, axis=-1)
+    cos_squared = cos_squared[..., np.newaxis, :]
+
+    weights = transition_weights[:, np.newaxis]
+
+    stark_shift = (m[:, np.newaxis] * stark_coefficient) * E_vectors[..., np.newaxis, :, 2]
+    stark_wavelength = stark_shift + np.asarray(doppler_shift)[..., np.newaxis, :]
+
+    I_polarised = (1 - cos_squared) * weights
+
+    #Only the sigma components contribute unpolarised light
+    sigma = (np.abs(m) <= 1)[:, np.newaxis]
+    I_unpolarised = np.where(sigma, 2 * cos_squared * np.abs(weights), 0.)
+
+    return I_polarised, I_unpolarised, stark_wavelength
+
+def stark_spectrum(beam_source, beam_duct, beam_span, lens_pos, beam_velocity, energy_fractions=(1., 1./2, 1./3)):
+
+    """
+    Stark lines along the beam for every energy component at once.
+    :param energy_fractions: Energies of the beam components as fractions of the full energy, see
+                             component_velocities.
+    :return: Dictionary of the sample points, emission vectors, Doppler shift, E field and the polarised and
+             unpolarised intensities and wavelengths of the Stark lines, indexed by energy component first.
+    """
+
+    velocities = component_velocities(beam_velocity, energy_fractions)
+
+    beam_vector, sample_points = beam_sample_points(beam_source, beam_duct, beam_span)
+    emission_vectors, doppler_shift = calculate_doppler_shift(sample_points, beam_vector, lens_pos, velocities)
+    E, E_vectors = calculate_Efield(sample_points, velocities, beam_vector)
+    I_polarised, I_unpolarised, stark_wavelength = calculate_line_intensities(E_vectors, emission_vectors, doppler_shift)
+
+    return {'beam_vector': beam_vector, 'sample_points': sample_points, 'emission_vectors': emission_vectors,
+            'doppler_shift': doppler_shift, 'E': E, 'E_vectors': E_vectors, 'I_polarised': I_polarised,
+            'I_unpolarised': I_unpolarised, 'stark_wavelength': stark_wavelength}
+
+def line_spectrum(centres, amplitudes, wavelength, sigma, width=5.):
+
+    """
+    Sum of Gaussian broadened lines on a uniform wavelength grid, ie. every Stark line of every line of sight at once.
+
+    Each line is shared between the two grid points either side of its centre (in proportion to its distance from
+    them), then all the spectra are convolved with the Gaussian once by FFT, using the analytic transform of the
+    Gaussian. The cost depends on the size of the grid rather than the number of lines. Line areas and centres are
+    exact, the peak heights are accurate to about (grid spacing/sigma)^2/8.
+    :param centres: Line centres, in the same units as the wavelength grid (Array - ..., n_lines).
+    :param amplitudes: Integrated intensity of each line, broadcast with centres (Array - ..., n_lines).
+    :param wavelength: Uniformly spaced wavelength grid (Array - n_wavelength).
+    :param sigma: Standard deviation of the Gaussian instrument and Doppler broadening, 0 for no broadening.
+    :param width: Lines are kept if they are within this many sigma of the grid.
+    :return: Spectra (Array - ..., n_wavelength).
+    """
+
+    wavelength = np.asarray(wavelength, dtype=np.float64)
+    step = wavelength[1] - wavelength[0]
+
+    if not np.allclose(np.diff(wavelength), step, rtol=10**-6, atol=0):
+        raise ValueError("line_spectrum needs a uniformly spaced wavelength grid")
+
+    centres, amplitudes = np.broadcast_arrays(np.asarray(centres, dtype=np.float64),
+                                              np.asarray(amplitudes, dtype=np.float64))
+    shape = centres.shape[:-1]
+    centres = centres.reshape(-1, centres.shape[-1])
+    amplitudes = amplitudes.reshape(centres.shape)
+
+    #The grid is padded so the tails of lines just off the grid are kept
+    pad = int(np.ceil(width * sigma / step)) + 1
+    n = len(wavelength) + 2 * pad
+
+    position = (centres - wavelength[0]) / step + pad
+    position = np.where(np.isfinite(position), position, -1.)
+    index = np.floor(position).astype(np.int64)
+    fraction = position - index
+
+    valid = (index >= 0) & (index < n - 1)
+    bins = (np.arange(len(centres))[:, np.newaxis] * n + index)[valid]
+    fraction, amplitudes = fraction[valid], amplitudes[valid]
+
+    spectra = np.bincount(bins, weights=amplitudes * (1 - fraction), minlength=len(centres) * n)
+    spectra += np.bincount(bins + 1, weights=amplitudes * fraction, minlength=len(centres) * n)
+    spectra = spectra.reshape(len(centres), n) / step
+
+    if sigma > 0:
+        #Long enough that the convolution does not wrap around onto the grid
+        n_fft = n + pad + (n + pad) % 2
+        transfer = np.exp(-2 * (np.pi * sigma * np.fft.rfftfreq(n_fft, step))**2)
+        spectra = np.fft.irfft(np.fft.rfft(spectra, n_fft, axis=-1) * transfer, n_fft, axis=-1)
+
+    return spectra[:, pad:pad + len(wavelength)].reshape(shape + (len(wavelength),))
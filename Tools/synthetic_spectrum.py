@@ -0,0 +1,202 @@
+import numpy as np
+from Tools.stark_spectrum import m, transition_weights, stark_coefficient, calculate_doppler_shift, line_spectrum, \
+    component_velocities
+
+"""
+Synthetic MSE spectra for every pixel of an imaging view, to compare against MSESIM.
+
+Each pixel is a ray from the collection lens. The ray is sampled around its closest approach to the beam axis, each
+sample point is weighted by a Gaussian beam profile, and the field from an equilibrium gives the motional Stark
+field E = v x B at the point for each beam energy component. The nine pi/sigma lines of every sample point are then
+placed on the wavelength grid and broadened with one FFT convolution per chunk (stark_spectrum.line_spectrum) to give
+the Stokes vector of the pixel.
+
+Pixels are processed in chunks, so memory use does not depend on the size of the view. The Stokes vectors are in the
+layout of MSESIM (pixels..., stokes component, wavelength) and can be wrapped with Model.Light.Light.from_stokes.
+
+Example:
+
+    eq = equilibrium(device='MAST', shot=24409, time=0.25)
+    rays = lens_rays(msesim.optical_axis, 0.085, x, y)
+    stokes = synthetic_spectra(msesim.collection_lens, rays, msesim.duct_coordinates, msesim.beam_axis_vector,
+                               beam_velocity, wavelength, eq)
+    light = Light.from_stokes(stokes, wavelength, x, y)
+"""
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def _field_function(bfield):
+
+    """
+    :param bfield: Equilibrium (anything with evaluate_points(R, Z)) or a function of (R, Z) returning BR, BZ, Bphi.
+    :return: Function of (R, Z) returning BR, BZ, Bphi.
+    """
+
+    if hasattr(bfield, 'evaluate_points'):
+        def field(R, Z):
+            fields = bfield.evaluate_points(R, Z)
+            return fields.BR, fields.BZ, fields.Bt
+        return field
+
+    return bfield
+
+def lens_rays(optical_axis, focal_length, x, y, up=(0., 0., 1.)):
+
+    """
+    Viewing directions of the pixels of a camera behind a lens.
+    :param optical_axis: Direction of the optical axis into the plasma (Array - 3).
+    :param focal_length: Focal length of the lens in m.
+    :param x: Horizontal position of the pixels on the sensor in m (Array - nx).
+    :param y: Vertical position of the pixels on the sensor in m (Array - ny).
+    :param up: Direction that is vertical on the sensor.
+    :return: Unit vectors from the lens along the line of sight of each pixel (Array - ny, nx, 3).
+    """
+
+    axis = _normalise(optical_axis)
+    horizontal, vertical = image_plane_basis(axis, up)
+
+    xx, yy = np.meshgrid(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+    return _normalise(focal_length * axis + xx[..., np.newaxis] * horizontal + yy[..., np.newaxis] * vertical)
+
+def image_plane_basis(directions, up=(0., 0., 1.)):
+
+    """
+    Horizontal and vertical unit vectors perpendicular to the lines of sight, polarisation angles are measured from
+    the horizontal towards the vertical.
+    :param directions: Unit vectors along the lines of sight (Array - ..., 3).
+    :return: Horizontal and vertical unit vectors (Array - ..., 3).
+    """
+
+    horizontal = _normalise(np.cross(np.asarray(up, dtype=np.float64), directions))
+    vertical = np.cross(directions, horizontal)
+
+    return horizontal, vertical
+
+def beam_closest_approach(lens_position, directions, beam_position, beam_axis):
+
+    """
+    :param lens_position: Position of the collection lens (Array - 3).
+    :param directions: Unit vectors along the lines of sight (Array - ..., 3).
+    :param beam_position: Any point on the beam axis, ie. the duct coordinates (Array - 3).
+    :param beam_axis: Unit vector along the beam (Array - 3).
+    :return: Distance along each line of sight to its closest approach to the beam axis (Array - ...). nan for lines
+             of sight parallel to the beam.
+    """
+
+    offset = np.asarray(lens_position, dtype=np.float64) - beam_position
+
+    cos_angle = directions @ beam_axis
+    along_sight = directions @ offset
+    along_beam = offset @ beam_axis
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (cos_angle * along_beam - along_sight) / (1 - cos_angle**2)
+
+def _pixel_stokes(lens_position, directions, beam_position, beam_axis, velocities, energy_weights, field,
+                  beam_width, half_width, n_samples, up):
+
+    """
+    Stark lines of a chunk of pixels.
+    :return: Line centres in m (Array - n_pixels, n_lines) and the Stokes components of each line
+             (Array - n_pixels, n_lines, 4), with n_lines = n_samples * n_energies * 9.
+    """
+
+    n_pixels = len(directions)
+
+    #Sample points along each line of sight, around the closest approach to the beam
+    closest = beam_closest_approach(lens_position, directions, beam_position, beam_axis)
+    steps = np.linspace(-half_width, half_width, n_samples)
+    distance = closest[:, np.newaxis] + steps
+    points = lens_position + distance[..., np.newaxis] * directions[:, np.newaxis, :]
+
+    #Gaussian beam profile, nothing is seen from behind the lens or along lines of sight that miss the beam
+    from_axis = points - beam_position
+    from_axis = from_axis - (from_axis @ beam_axis)[..., np.newaxis] * beam_axis
+    weight = np.exp(-0.5 * np.sum(from_axis**2, axis=-1) / beam_width**2) * (steps[1] - steps[0] if n_samples > 1 else 1.)
+    weight = np.where((distance > 0) & np.isfinite(distance), weight, 0.)
+    points = np.where(np.isfinite(points), points, 0.)
+
+    #Field in machine coordinates from the cylindrical components of the equilibrium
+    R = np.hypot(points[..., 0], points[..., 1])
+    phi = np.arctan2(points[..., 1], points[..., 0])
+    BR, BZ, Bphi = field(R, points[..., 2])
+    B = np.stack([BR * np.cos(phi) - Bphi * np.sin(phi), BR * np.sin(phi) + Bphi * np.cos(phi), BZ], axis=-1)
+    B = np.where(np.isfinite(B), B, 0.)
+
+    emission_vectors, doppler_shift = calculate_doppler_shift(points, beam_axis, lens_position, velocities)
+    E_vectors = np.multiply.outer(velocities, np.cross(beam_axis, B))
+    E = np.linalg.norm(E_vectors, axis=-1)
+
+    #Angle of the E field and of the line of sight to it, seen in the image plane of each pixel
+    horizontal, vertical = image_plane_basis(directions, up)
+    gamma = np.arctan2(np.einsum('kpsi,pi->kps', E_vectors, vertical), np.einsum('kpsi,pi->kps', E_vectors, horizontal))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_squared = np.nan_to_num(np.sum(E_vectors * emission_vectors, axis=-1)**2 / E**2)
+
+    #Lines indexed (energy, pixel, sample, component)
+    centres = doppler_shift[..., np.newaxis] + stark_coefficient * E[..., np.newaxis] * m
+    intensity = (np.asarray(energy_weights, dtype=np.float64)[:, np.newaxis, np.newaxis] * weight)[..., np.newaxis]
+
+    #pi lines (negative weights) are polarised along E and sigma lines across it, the sigma lines have an
+    #unpolarised part as well
+    polarised = intensity * (1 - cos_squared)[..., np.newaxis] * transition_weights
+    unpolarised = intensity * 2 * cos_squared[..., np.newaxis] * np.where(np.abs(m) <= 1, transition_weights, 0.)
+
+    amplitudes = np.stack([np.abs(polarised) + unpolarised,
+                           -polarised * np.cos(2 * gamma)[..., np.newaxis],
+                           -polarised * np.sin(2 * gamma)[..., np.newaxis],
+                           np.zeros_like(polarised)], axis=-1)
+
+    centres = np.moveaxis(centres, 1, 0).reshape(n_pixels, -1)
+    amplitudes = np.moveaxis(amplitudes, 1, 0).reshape(n_pixels, -1, 4)
+
+    return centres, amplitudes
+
+def synthetic_spectra(lens_position, directions, beam_position, beam_axis, beam_velocity, wavelength, bfield,
+                      energy_fractions=(1., 1./2, 1./3), energy_weights=(1., 1., 1.), beam_width=0.08,
+                      half_width=0.25, n_samples=20, sigma=0.085 * 10**-9, up=(0., 0., 1.), chunk_size=1024):
+
+    """
+    :param lens_position: Position of the collection lens in m (Array - 3).
+    :param directions: Unit vectors from the lens along the line of sight of each pixel (Array - ..., 3).
+    :param beam_position: Any point on the beam axis in m, ie. the duct coordinates (Array - 3).
+    :param beam_axis: Direction of the beam (Array - 3).
+    :param beam_velocity: Velocity of the full energy component in m/s.
+    :param wavelength: Uniformly spaced wavelength grid in m (Array - n_wavelength).
+    :param bfield: Equilibrium to take the field from (anything with evaluate_points(R, Z), ie. eq.equilibrium),
+                   or a function of (R, Z) returning BR, BZ, Bphi.
+    :param energy_fractions: Energies of the beam components as fractions of the full energy, see
+                             stark_spectrum.component_velocities.
+    :param energy_weights: Relative emission of each energy component.
+    :param beam_width: Standard deviation in m of the Gaussian beam profile across the beam axis.
+    :param half_width: Each line of sight is sampled this far in m either side of its closest approach to the beam.
+    :param n_samples: Number of sample points along each line of sight.
+    :param sigma: Standard deviation in m of the Gaussian instrument and Doppler broadening.
+    :param up: Direction that is vertical in the image, polarisation angles are measured from the horizontal.
+    :param chunk_size: Number of pixels calculated at a time.
+    :return: Stokes vectors S0-S3 of each pixel (Array - ..., 4, n_wavelength).
+    """
+
+    lens_position = np.asarray(lens_position, dtype=np.float64)
+    beam_position = np.asarray(beam_position, dtype=np.float64)
+    beam_axis = _normalise(beam_axis)
+    wavelength = np.asarray(wavelength, dtype=np.float64)
+    velocities = component_velocities(beam_velocity, energy_fractions)
+    field = _field_function(bfield)
+
+    directions = _normalise(directions)
+    pixel_shape = directions.shape[:-1]
+    directions = directions.reshape(-1, 3)
+
+    stokes = np.empty((len(directions), 4, len(wavelength)))
+
+    for start in range(0, len(directions), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        centres, amplitudes = _pixel_stokes(lens_position, directions[chunk], beam_position, beam_axis, velocities,
+                                            energy_weights, field, beam_width, half_width, n_samples, up)
+        stokes[chunk] = line_spectrum(centres[:, np.newaxis, :], np.moveaxis(amplitudes, -1, 1), wavelength, sigma)
+
+    return stokes.reshape(pixel_shape + (4, len(wavelength)))
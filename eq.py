@@ -8,11 +8,14 @@ Nick Walkden, James Harrison, Anthony field June 2015
 John Omotani April 2018
 """
 
+import json
 import numpy as np
 from copy import deepcopy as copy
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 fluxSurface = namedtuple('fluxSurface', 'R Z')
+frameFields = namedtuple('frameFields', 'psi psiN BR BZ Bt')
+pointFields = namedtuple('pointFields', 'psiN BR BZ Bt')
 try:
     # Try to import Afields Point class
     from pyDivertor.Utilities.utilities import Point
@@ -22,12 +25,259 @@ except:
 
 from scipy.interpolate import interp1d
 from scipy.interpolate import RectBivariateSpline
+from scipy.interpolate import RegularGridInterpolator
+
+
+# Attribute the signal is stored in and its IDAM name, for each signal read by equilibrium.load_MAST
+MAST_SIGNALS = {'_psi': "efm_psi(r,z)",
+                '_r': "efm_grid(r)",
+                '_z': "efm_grid(z)",
+                '_psi_axis': "efm_psi_axis",
+                '_psi_bnd': "efm_psi_boundary",
+                '_cpasma': "efm_plasma_curr(C)",
+                '_bphi': "efm_bvac_val",
+                '_xpoint1r': "efm_xpoint1_r(c)",
+                '_xpoint1z': "efm_xpoint1_z(c)",
+                '_xpoint2r': "efm_xpoint2_r(c)",
+                '_xpoint2z': "efm_xpoint2_z(c)",
+                '_axisr': "efm_magnetic_axis_r",
+                '_axisz': "efm_magnetic_axis_z"}
 
 
 def interp2d(R, Z, field):
     return RectBivariateSpline(R, Z, np.transpose(field))
 
 
+# Marching squares cell edges, numbered bottom, right, top, left. For each cell case (bit 1 set if the bottom left
+# corner is above the level, 2 bottom right, 4 top right, 8 top left) the pairs of edges joined by a segment.
+# Saddle cases 5 and 10 are given for a cell centre below the level, and are swapped to the other pairing
+# (_SADDLE_ABOVE) when the centre is above.
+_CELL_SEGMENTS = {1: [(0, 3)], 2: [(0, 1)], 3: [(1, 3)], 4: [(1, 2)], 5: [(0, 3), (1, 2)], 6: [(0, 2)],
+                  7: [(2, 3)], 8: [(2, 3)], 9: [(0, 2)], 10: [(0, 1), (2, 3)], 11: [(1, 2)], 12: [(1, 3)],
+                  13: [(0, 1)], 14: [(0, 3)]}
+_SADDLE_ABOVE = {5: [(0, 1), (2, 3)], 10: [(0, 3), (1, 2)]}
+
+
+def contour_paths(R, Z, field, levels):
+    """
+    Contour lines of a field on a rectangular grid by marching squares, for several levels in one pass
+
+    arguments:
+        R = array   grid points in R (nr)
+        Z = array   grid points in Z (nz)
+        field = array   values on the grid (nz, nr)
+        levels = list   contour levels
+
+    returns:
+        list with, for each level, a list of paths as arrays of (R, Z) vertices (n, 2). Closed paths
+        end with their first vertex.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    Z = np.asarray(Z, dtype=np.float64)
+    field = np.asarray(field, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64).reshape(-1)
+    nz, nr = field.shape
+    nl = len(levels)
+
+    # Crossing points on every edge, for every level. Horizontal edges join (iz, ir) to (iz, ir + 1) and are
+    # numbered iz * (nr - 1) + ir, vertical edges join (iz, ir) to (iz + 1, ir) and are numbered after them.
+    n_horizontal = nz * (nr - 1)
+    n_edges = n_horizontal + (nz - 1) * nr
+
+    diff = field[np.newaxis, :, :] - levels[:, np.newaxis, np.newaxis]
+    above = diff >= 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_horizontal = diff[:, :, :-1] / (diff[:, :, :-1] - diff[:, :, 1:])
+        t_vertical = diff[:, :-1, :] / (diff[:, :-1, :] - diff[:, 1:, :])
+
+    vertex_R = np.concatenate([(R[:-1] + t_horizontal * np.diff(R)).reshape(nl, -1),
+                               np.broadcast_to(R, t_vertical.shape).reshape(nl, -1)], axis=1).ravel()
+    vertex_Z = np.concatenate([np.broadcast_to(Z[:, np.newaxis], t_horizontal.shape).reshape(nl, -1),
+                               (Z[:-1, np.newaxis] + t_vertical * np.diff(Z)[:, np.newaxis]).reshape(nl, -1)],
+                              axis=1).ravel()
+
+    # Cell cases and the ids of the four edges of each cell
+    case = (above[:, :-1, :-1] * 1 + above[:, :-1, 1:] * 2 + above[:, 1:, 1:] * 4 + above[:, 1:, :-1] * 8).ravel()
+    centre_above = (diff[:, :-1, :-1] + diff[:, :-1, 1:] + diff[:, 1:, 1:] + diff[:, 1:, :-1]).ravel() >= 0
+
+    il, iz, ir = np.unravel_index(np.arange(case.size), (nl, nz - 1, nr - 1))
+    offset = il * n_edges
+    cell_edges = np.stack([offset + iz * (nr - 1) + ir,
+                           offset + n_horizontal + iz * nr + ir + 1,
+                           offset + (iz + 1) * (nr - 1) + ir,
+                           offset + n_horizontal + iz * nr + ir], axis=1)
+
+    start, end = [], []
+    for cell_case, segments in _CELL_SEGMENTS.items():
+        cells = case == cell_case
+        if cell_case in _SADDLE_ABOVE:
+            for saddle, pairs in ((cells & ~centre_above, segments), (cells & centre_above, _SADDLE_ABOVE[cell_case])):
+                for a, b in pairs:
+                    start.append(cell_edges[saddle, a])
+                    end.append(cell_edges[saddle, b])
+        else:
+            for a, b in segments:
+                start.append(cell_edges[cells, a])
+                end.append(cell_edges[cells, b])
+
+    start = np.concatenate(start)
+    end = np.concatenate(end)
+
+    # Link the segments into paths. Every edge is shared by at most two segments, paths with an end on the
+    # grid boundary are traced first, then closed paths.
+    neighbours = {}
+    for i, (a, b) in enumerate(zip(start.tolist(), end.tolist())):
+        neighbours.setdefault(a, []).append(i)
+        neighbours.setdefault(b, []).append(i)
+
+    used = np.zeros(len(start), dtype=bool)
+    paths = [[] for _ in range(nl)]
+
+    def trace(edge, segment):
+        path = [edge]
+        while segment is not None:
+            used[segment] = True
+            edge = end[segment] if start[segment] == edge else start[segment]
+            path.append(edge)
+            segment = next((s for s in neighbours[edge] if not used[s]), None)
+        return path
+
+    open_ends = [edge for edge, segments in neighbours.items() if len(segments) == 1]
+    for edge in open_ends:
+        segment = neighbours[edge][0]
+        if not used[segment]:
+            path = trace(edge, segment)
+            paths[path[0] // n_edges].append(np.stack([vertex_R[path], vertex_Z[path]], axis=1))
+
+    for segment in np.nonzero(~used)[0]:
+        if not used[segment]:
+            path = trace(start[segment], segment)
+            paths[path[0] // n_edges].append(np.stack([vertex_R[path], vertex_Z[path]], axis=1))
+
+    return paths
+
+
+def spline_from_tck(tck, degrees):
+    """
+    RectBivariateSpline from its knots and coefficients (as stored in spline.tck and spline.degrees),
+    without fitting the spline again
+    """
+    spline = RectBivariateSpline.__new__(RectBivariateSpline)
+    spline.tck = tuple(np.asarray(t, dtype=np.float64) for t in tck)
+    spline.degrees = tuple(int(k) for k in degrees)
+    return spline
+
+
+def write_block(f, values, fmt='%17.8f', ncol=5, lines_per_write=10000):
+    """
+    Write an array to an open text file, ncol values per line with the remainder on a final short line.
+    Whole blocks of lines are formatted with a single string operation.
+    """
+    values = np.ravel(values)
+    nfull = (len(values) // ncol) * ncol
+    line = fmt * ncol + '\n'
+
+    step = lines_per_write * ncol
+    for start in range(0, nfull, step):
+        block = values[start:min(start + step, nfull)]
+        f.write((line * (len(block) // ncol)) % tuple(block))
+
+    if nfull < len(values):
+        f.write((fmt * (len(values) - nfull) + '\n') % tuple(values[nfull:]))
+
+
+def _ccw(xa, ya, xb, yb, xc, yc):
+    """ True where the points a, b, c are counterclockwise """
+    return (yc - ya) * (xb - xa) > (yb - ya) * (xc - xa)
+
+
+class wallGeometry(object):
+    """
+    Wall polygon with a uniform grid index over its segments, so that intersection tests with a line only
+    check the wall segments in the grid cells the line passes near.
+
+    arguments:
+        R, Z = arrays   wall polygon vertices
+        cell_size = float   size of the grid cells, defaults to the mean length of a wall segment
+    """
+
+    def __init__(self, R, Z, cell_size=None):
+
+        self.R = np.asarray(R, dtype=np.float64)
+        self.Z = np.asarray(Z, dtype=np.float64)
+
+        self.xc, self.yc = self.R[:-1], self.Z[:-1]
+        self.xd, self.yd = self.R[1:], self.Z[1:]
+        self.nseg = len(self.xc)
+
+        extent = max(np.ptp(self.R), np.ptp(self.Z), 1e-12)
+        if cell_size is None:
+            cell_size = max(np.mean(np.hypot(self.xd - self.xc, self.yd - self.yc)), 1e-3 * extent)
+        self.cell_size = cell_size
+        self.origin = (np.min(self.R), np.min(self.Z))
+        self.nx = int(np.ptp(self.R) / cell_size) + 1
+        self.ny = int(np.ptp(self.Z) / cell_size) + 1
+
+        # Cells covered by the bounding box of each wall segment, sorted by cell so that
+        # the segments in cell i are self._segments[self._cell_start[i]:self._cell_start[i + 1]]
+        segment, cell = self._cells(self.xc, self.yc, self.xd, self.yd)
+        order = np.argsort(cell, kind='stable')
+        self._segments = segment[order]
+        self._cell_start = np.searchsorted(cell[order], np.arange(self.nx * self.ny + 1))
+
+    def _cells(self, xa, ya, xb, yb):
+        """
+        Grid cells overlapped by the bounding boxes of the segments a-b, clipped to the grid
+
+        returns:
+            (segment index, cell index) for each overlap
+        """
+        def cell_range(a, b, origin, n):
+            lower = np.clip(np.floor((np.minimum(a, b) - origin) / self.cell_size), 0, n - 1).astype(int)
+            upper = np.clip(np.floor((np.maximum(a, b) - origin) / self.cell_size), 0, n - 1).astype(int)
+            return lower, upper - lower + 1
+
+        ix, nx = cell_range(xa, xb, self.origin[0], self.nx)
+        iy, ny = cell_range(ya, yb, self.origin[1], self.ny)
+
+        counts = nx * ny
+        segment = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        cell = (iy[segment] + local // nx[segment]) * self.nx + ix[segment] + local % nx[segment]
+        return segment, cell
+
+    def candidate_pairs(self, xa, ya, xb, yb):
+        """
+        Pairs of (line segment, wall segment) indices whose bounding boxes share a grid cell, each pair once
+        """
+        line, cell = self._cells(xa, ya, xb, yb)
+
+        counts = self._cell_start[cell + 1] - self._cell_start[cell]
+        line = np.repeat(line, counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        wall = self._segments[np.repeat(self._cell_start[cell], counts) + local]
+
+        pairs = np.unique(line * self.nseg + wall)
+        return pairs // self.nseg, pairs % self.nseg
+
+    def count_intersections(self, R, Z):
+        """
+        Number of intersections between the wall and the line with points (R, Z)
+        """
+        xa, ya = np.asarray(R[:-1], dtype=np.float64), np.asarray(Z[:-1], dtype=np.float64)
+        xb, yb = np.asarray(R[1:], dtype=np.float64), np.asarray(Z[1:], dtype=np.float64)
+
+        line, wall = self.candidate_pairs(xa, ya, xb, yb)
+        xa, ya, xb, yb = xa[line], ya[line], xb[line], yb[line]
+        xc, yc, xd, yd = self.xc[wall], self.yc[wall], self.xd[wall], self.yd[wall]
+
+        intersections = ((_ccw(xa, ya, xc, yc, xd, yd) != _ccw(xb, yb, xc, yc, xd, yd))
+                         & (_ccw(xa, ya, xb, yb, xc, yc) != _ccw(xa, ya, xb, yb, xd, yd)))
+        return intersections.sum()
+
+
 class equilibriumField(object):
     """
     Container for fields of the equilibrium.
@@ -41,18 +291,59 @@ class equilibriumField(object):
         data = myfield(R,Z)
 
     NOTE:
-        At present, operations on two equilibriumField objects, i.e
+        Operations on equilibriumField objects, i.e
 
         equilibriumField + equilibriumField
 
-        return the value of their data only as a numpy array, and do not return
-        an equilibriumField object
-    """
+        return a new equilibriumField. Its data is only calculated from the data of the
+        operands when it is first indexed, and calling it evaluates the functions of the
+        operands and combines the results, so no new spline is fitted. Where an operand
+        has no function (ie. a plain array) the field is fitted with a spline on its grid
+        the first time it is called.
 
-    def __init__(self, data, function):
+        If data is None it is evaluated from the function on grid = (R, Z) the
+        first time it is needed
+    """
 
-        self._data = data
-        self._func = function
+    # Take precedence over numpy scalars and arrays in arithmetic
+    __array_priority__ = 1000
+
+    def __init__(self, data, function, grid=None):
+
+        self._values = data
+        self._function = function
+        self.grid = grid
+
+    @property
+    def _data(self):
+        if self._values is None:
+            R, Z = self.grid
+            self._values = np.transpose(self._func(R, Z))
+        elif callable(self._values):
+            self._values = self._values()
+        return self._values
+
+    @property
+    def _func(self):
+        if self._function is None and self.grid is not None:
+            self._function = interp2d(self.grid[0], self.grid[1], self._data)
+        return self._function
+
+    @property
+    def ndim(self):
+        if isinstance(self._values, np.ndarray):
+            return self._values.ndim
+        elif self.grid is not None:
+            return len(self.grid)
+        return np.ndim(self._data)
+
+    @property
+    def shape(self):
+        return np.shape(self._data)
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.asarray(self._data)
+        return data if dtype is None else data.astype(dtype)
 
     def __getitem__(self, inds):
         return self._data[inds]
@@ -60,56 +351,98 @@ class equilibriumField(object):
     def __len__(self):
         return len(self._data)
 
-    def __add__(self, other):
-        if type(other) is type(self):
-            return self._data + other._data
-        else:
-            return self._data + other
+    def _combine(self, other, op):
+        """
+        Lazy field op(self, other), other may be a field, a scalar or an array on the grid
+        """
+        if isinstance(other, equilibriumField):
+            first, second = self, other
 
-    def __radd__(self, other):
-        return self.__add__(other)
+            def data():
+                return op(first._data, second._data)
 
-    def __sub__(self, other):
-        if type(other) is type(self):
-            return self._data - other._data
-        else:
-            return self._data - other
+            if self._function is not None and other._function is not None:
+                def function(*args, **kwargs):
+                    return op(first._function(*args, **kwargs), second._function(*args, **kwargs))
+            else:
+                function = None
 
-    def __truediv__(self, other):
-        if type(other) is type(self):
-            return self._data / other._data
-        else:
-            return self._data / other
+            return equilibriumField(data, function, grid=self.grid if self.grid is not None else other.grid)
+
+        elif np.ndim(other) == 0:
+            first = self
+
+            def data():
+                return op(first._data, other)
+
+            if self._function is not None:
+                def function(*args, **kwargs):
+                    return op(first._function(*args, **kwargs), other)
+            else:
+                function = None
+
+            return equilibriumField(data, function, grid=self.grid)
 
-    def __itruediv__(self, other):
-        if type(other) is type(self):
-            return other._data / self._data
         else:
-            return other / self._data
+            # Array on the grid, can only be evaluated off the grid by fitting a spline to the result
+            return equilibriumField(op(self._data, other), None, grid=self.grid)
+
+    def __add__(self, other):
+        return self._combine(other, lambda a, b: a + b)
+
+    def __radd__(self, other):
+        return self._combine(other, lambda a, b: b + a)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a - b)
 
     def __rsub__(self, other):
-        return -1.0 * (self.__sub__(other))
+        return self._combine(other, lambda a, b: b - a)
 
     def __mul__(self, other):
-        if type(other) is type(self):
-            return self._data * other._data
-        else:
-            return self._data * other
+        return self._combine(other, lambda a, b: a * b)
 
     def __rmul__(self, other):
-        if type(other) is type(self):
-            return other._data * self._data
-        else:
-            return other * self._data
+        return self._combine(other, lambda a, b: b * a)
+
+    def __truediv__(self, other):
+        return self._combine(other, lambda a, b: a / b)
+
+    def __rtruediv__(self, other):
+        return self._combine(other, lambda a, b: b / a)
 
     def __pow__(self, power):
-        return self._data ** power
+        return self._combine(power, lambda a, b: a ** b)
+
+    def __neg__(self):
+        return self._combine(-1.0, lambda a, b: a * b)
 
     def __setitem__(self, inds, values):
         self._data[inds] = values
 
+    def at_points(self, R, Z, chunk_size=2**16):
+        """
+        Evaluate the field at scattered points, ie. self(R, Z, grid=False), in chunks of chunk_size points
+
+        arguments:
+            R = array   major radius of the points
+            Z = array   height of the points, broadcast with R
+
+        returns:
+            array of the field at the points, the broadcast shape of R and Z
+        """
+        R, Z = np.broadcast_arrays(np.asarray(R, dtype=np.float64), np.asarray(Z, dtype=np.float64))
+        out = np.empty(R.shape)
+
+        R_points, Z_points, out_points = R.ravel(), Z.ravel(), out.reshape(-1)
+        for start in range(0, R_points.size, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            out_points[chunk] = self._func(R_points[chunk], Z_points[chunk], grid=False)
+
+        return out
+
     def __call__(self, *args, **kwargs):
-        if len(self._data.shape) > 1:
+        if self.ndim > 1:
             return np.transpose(self._func(*args, **kwargs))
         else:
             return self._func(*args, **kwargs)
@@ -150,7 +483,8 @@ class equilibrium(object):
         axis        Point       position of the magnetic axis as a Point type (see above)
     """
 
-    def __init__(self, device=None, shot=None, time=None, gfile=None, with_bfield=True, verbose=False, mdsport=None):
+    def __init__(self, device=None, shot=None, time=None, gfile=None, with_bfield=True, verbose=False, mdsport=None,
+                 client=None, snapshot=None):
         self.psi = None
         self.psiN = None
         self._loaded = False
@@ -178,10 +512,16 @@ class equilibrium(object):
         self.nxpt = 0.0
         self.xpoint = []
         self.axis = None
+        self._tind = None
+        self._flux_surfaces = None
+        self._fpolRZ_key = None
+        self._wall_geometry = None
+        self._slice_cache = OrderedDict()
+        self.slice_cache_size = 32
 
         if shot is not None and time is not None:
             if device is 'MAST':
-                self.load_MAST(shot, time, with_bfield=with_bfield, verbose=verbose)
+                self.load_MAST(shot, time, with_bfield=with_bfield, verbose=verbose, client=client)
             elif device is 'JET':
                 self.load_JET(shot, time, with_bfield=with_bfield, verbose=verbose)
             elif device is 'TCV':
@@ -195,6 +535,8 @@ class equilibrium(object):
         else:
             if gfile is not None:
                 self.load_geqdsk(gfile, with_bfield=with_bfield, verbose=verbose)
+            elif snapshot is not None:
+                self.load_snapshot(snapshot, with_bfield=with_bfield, verbose=verbose)
             else:
                 return
 
@@ -237,7 +579,7 @@ class equilibrium(object):
         if rev_Bt:
             fpol = -fpol
         psigrid = np.linspace(self.psi_axis, self.psi_bnd, len(fpol))
-        fpol_func = None  # np.vectorize(interp1d(psigrid,fpol))
+        fpol_func = interp1d(psigrid, fpol)
         self.fpol = equilibriumField(fpol, fpol_func)
 
         self._loaded = True
@@ -246,8 +588,7 @@ class equilibrium(object):
         if rev_Bt:
             self.Btcent = -self.Btcent
 
-        psiN_func = interp2d(self.R, self.Z, (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis))
-        self.psiN = equilibriumField((self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis), psiN_func)
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
         R = ingf['rlim']
         Z = ingf['zlim']
@@ -262,77 +603,153 @@ class equilibrium(object):
         self._loaded = True
 
     def dump_geqdsk(self, filename="equilibrium.g"):
-        from geqdsk import Geqdsk
+        """
+        Saves the equilibrium in an EFIT geqdsk file, written directly in the standard
+        (5e16.9) format with every array formatted in blocks
+        """
         if self._loaded:
             print("Writing gfile: " + filename)
-            outgf = Geqdsk()
-            outgf.set('nw', self.nr)
-            outgf.set('nh', self.nz)
-            outgf.set('rleft', np.min(self.R))
-            outgf.set('rdim', np.max(self.R) - np.min(self.R))
-            outgf.set('zdim', np.max(self.Z) - np.min(self.Z))
-            outgf.set('zmid', 0.5 * (np.max(self.Z) + np.min(self.Z)))
-            outgf.set('psirz', self.psi[:])
-            outgf.set('simag', self.psi_axis)
-            outgf.set('sibry', self.psi_bnd)
-            outgf.set('current', self.sigBp)
-            outgf.set('rmaxis', self.axis.r)
-            outgf.set('zmaxis', self.axis.z)
-            outgf.set('xdum', 0.00000)
-            outgf.set('pres', np.zeros(self.nr))
-            outgf.set('pprime', np.zeros(self.nr))
-            outgf.set('ffprime', np.zeros(self.nr))
-            outgf.set('qpsi', np.zeros(self.nr))
+
+            nw, nh = self.nr, self.nz
+            rdim = np.max(self.R) - np.min(self.R)
+            zdim = np.max(self.Z) - np.min(self.Z)
+            zmid = 0.5 * (np.max(self.Z) + np.min(self.Z))
+            xdum = 0.0
+
             if self.fpol is not None:
-                outgf.set('fpol', self.fpol[:])
+                fpol = np.asarray(self.fpol[:], dtype=np.float64)
+                if len(fpol) != nw:
+                    fpol = np.interp(np.linspace(0, 1, nw), np.linspace(0, 1, len(fpol)), fpol)
             else:
-                outgf.set('fpol', np.zeros(self.nr) + self.Rcent * self.Btcent)
-            outgf.set('bcentr', self.Btcent)
-            outgf.set('rcentr', self.Rcent)
-            outgf.set('rlim', self.wall['R'])
-            outgf.set('zlim', self.wall['Z'])
+                fpol = np.zeros(nw) + self.Rcent * self.Btcent
+
             boundary = self.get_fluxsurface(1.0)
-            outgf.set('rbbbs', boundary.R)
-            outgf.set('zbbbs', boundary.Z)
-            outgf.set('nbbbs', len(list(boundary.R)))
-            outgf.dump(filename)
+
+            with open(filename, 'w') as f:
+                f.write('%-48s%4d%4d%4d\n' % ('  pyEquilibrium', 0, nw, nh))
+                write_block(f, [rdim, zdim, self.Rcent, np.min(self.R), zmid,
+                                self.axis.r, self.axis.z, self.psi_axis, self.psi_bnd, self.Btcent,
+                                self.sigBp, self.psi_axis, xdum, self.axis.r, xdum,
+                                self.axis.z, xdum, self.psi_bnd, xdum, xdum], fmt='%16.9E')
+                write_block(f, fpol, fmt='%16.9E')
+                for profile in ('pres', 'ffprime', 'pprime'):
+                    write_block(f, np.zeros(nw), fmt='%16.9E')
+                write_block(f, self.psi[:], fmt='%16.9E')
+                write_block(f, np.zeros(nw), fmt='%16.9E')  # qpsi
+                f.write('%5d%5d\n' % (len(boundary.R), len(self.wall['R'])))
+                write_block(f, np.stack([boundary.R, boundary.Z], axis=1), fmt='%16.9E')
+                write_block(f, np.stack([self.wall['R'], self.wall['Z']], axis=1), fmt='%16.9E')
         else:
             print("WARNING: No equilibrium loaded, cannot write gfile")
 
-    def load_MAST(self, shot, time, with_bfield=True, verbose=False):
+    def save_snapshot(self, filename):
+        """
+        Save the equilibrium as a binary snapshot (.npz) that load_snapshot can rebuild without refitting any
+        splines: the grid, psi and the psi and fpolRZ spline coefficients, fpol, the wall, x-points,
+        axis and the equilibrium parameters
+        """
+        if not self._loaded:
+            print("WARNING: No equilibrium loaded, cannot write snapshot")
+            return
+        if self.fpolRZ is None:
+            self.__get_fpolRZ()
+
+        def point(p):
+            return [float(p[0]), float(p[1])]
+
+        metadata = {'machine': self.machine,
+                    'shot': None if getattr(self, '_shot', None) is None else int(self._shot),
+                    'time': None if self._time is None else float(self._time),
+                    'psi_axis': float(self.psi_axis), 'psi_bnd': float(self.psi_bnd),
+                    'sigBp': float(self.sigBp), 'Btcent': float(self.Btcent), 'Rcent': float(self.Rcent),
+                    'nxpt': self.nxpt, 'axis': point(self.axis),
+                    'xpoints': {name: point(p) for name, p in (getattr(self, 'xpoints', None) or {}).items()},
+                    'spoints': None if getattr(self, 'spoints', None) is None else
+                               {name: point(p) for name, p in self.spoints.items()}}
+
+        arrays = {'R': self.R, 'Z': self.Z, 'psi': self.psi[:], 'fpolRZ': self.fpolRZ[:],
+                  'wall_R': self.wall['R'], 'wall_Z': self.wall['Z']}
+        if self.fpol is not None:
+            arrays['fpol'] = self.fpol[:]
+        for name in ('psi', 'fpolRZ'):
+            spline = getattr(self, name)._func
+            arrays[name + '_tx'], arrays[name + '_ty'], arrays[name + '_c'] = spline.tck
+            arrays[name + '_degrees'] = spline.degrees
+
+        np.savez(filename, metadata=json.dumps(metadata), **arrays)
+
+    def load_snapshot(self, filename, with_bfield=True, verbose=False):
+        """
+        Load an equilibrium saved by save_snapshot. The splines are rebuilt from their stored coefficients.
+        """
+        if verbose: print("\nLoading equilibrium snapshot " + str(filename) + "\n")
+
+        with np.load(filename) as saved:
+            metadata = json.loads(str(saved['metadata']))
+
+            def spline(name):
+                return spline_from_tck((saved[name + '_tx'], saved[name + '_ty'], saved[name + '_c']),
+                                       saved[name + '_degrees'])
+
+            self.R = saved['R']
+            self.Z = saved['Z']
+            self.psi = equilibriumField(saved['psi'], spline('psi'))
+            self.fpolRZ = equilibriumField(saved['fpolRZ'], spline('fpolRZ'))
+            self.wall = {'R': saved['wall_R'], 'Z': saved['wall_Z']}
+            fpol = saved['fpol'] if 'fpol' in saved.files else None
+
+        # The snapshot has no connection to the data source, so set_time is not available
+        self.machine = None
+        self.snapshot_source = (metadata['machine'], metadata['shot'], metadata['time'])
+        self._shot = metadata['shot']
+        self._time = metadata['time']
+        self.nr = len(self.R)
+        self.nz = len(self.Z)
+
+        for name in ('psi_axis', 'psi_bnd', 'sigBp', 'Btcent', 'Rcent', 'nxpt'):
+            setattr(self, name, metadata[name])
+        self.axis = Point(*metadata['axis'])
+        self.xpoints = {name: Point(*p) for name, p in metadata['xpoints'].items()}
+        self.spoints = None if metadata['spoints'] is None else {name: Point(*p) for name, p in
+                                                                 metadata['spoints'].items()}
+
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
+        if fpol is not None:
+            psigrid = np.linspace(self.psi_axis, self.psi_bnd, len(fpol))
+            self.fpol = equilibriumField(fpol, interp1d(psigrid, fpol))
+        else:
+            self.fpol = None
+
+        self._loaded = True
+        if with_bfield: self.__build_bfield()
+
+    def load_MAST(self, shot, time, with_bfield=True, verbose=False, client=None):
         """ Read in data from MAST IDAM
 
         arguments:
             shot = int  shot number to read in
             time = float    time to read in data at
+            client = data access client (see Tools.data_access), defaults to IDAM
+                     with signals recorded in the local shot cache
         """
 
-        try:
-            import idam
-            idam.setHost("idam1")
-        except:
-            raise ImportError("No Idam module found, cannot load MAST shot")
-
         if verbose: print("\nLoading equilibrium from MAST shot " + str(shot) + "\n")
 
         self.machine = 'MAST'
         self._shot = shot
         if not self._loaded:
-            self._psi = idam.Data("efm_psi(r,z)", shot)
-            self._r = idam.Data("efm_grid(r)", shot)
-            self._z = idam.Data("efm_grid(z)", shot)
-            self._psi_axis = idam.Data("efm_psi_axis", shot)
-            self._psi_bnd = idam.Data("efm_psi_boundary", shot)
-            self._cpasma = idam.Data("efm_plasma_curr(C)", shot)
-            self._bphi = idam.Data("efm_bvac_val", shot)
-            self._xpoint1r = idam.Data("efm_xpoint1_r(c)", shot)
-            self._xpoint1z = idam.Data("efm_xpoint1_z(c)", shot)
-            self._xpoint2r = idam.Data("efm_xpoint2_r(c)", shot)
-            self._xpoint2z = idam.Data("efm_xpoint2_z(c)", shot)
-            self._axisr = idam.Data("efm_magnetic_axis_r", shot)
-            self._axisz = idam.Data("efm_magnetic_axis_z", shot)
-
-        tind = np.abs(self._psi.time - time).argmin()
+            if client is None:
+                try:
+                    from Tools.data_access import get_client
+                except:
+                    raise ImportError("No data_access module found, cannot load MAST shot")
+                client = get_client('idam')
+
+            for attr, signal in MAST_SIGNALS.items():
+                setattr(self, attr, client.get(signal, shot))
+
+        tind = self._time_index(time)
+        self._tind = tind
         self.R = self._r.data[0, :]
         self.Z = self._z.data[0, :]
 
@@ -364,8 +781,7 @@ class equilibrium(object):
         self._loaded = True
         self._time = self._psi.time[tind]
 
-        psiN_func = interp2d(self.R, self.Z, (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis))
-        self.psiN = equilibriumField((self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis), psiN_func)
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
         # Previously included version of MAST wall, without structures for poloidal field coils
         # R = [
@@ -508,7 +924,8 @@ class equilibrium(object):
 
         self._psi_data = np.reshape(self._psi_data, (len(self._t_psi), len(self._psi_r), len(self._psi_z)))
 
-        tind = np.abs(np.asarray(self._t_psi) - time).argmin()
+        tind = self._time_index(time)
+        self._tind = tind
 
         # Define the wall geometry
         wall_r = np.array([
@@ -563,8 +980,7 @@ class equilibrium(object):
 
         tmp = (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
-        psiN_func = interp2d(self.R, self.Z, (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis))
-        self.psiN = equilibriumField((self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis), psiN_func)
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
         self._loaded = True
         self._time = self._t_psi[tind]
@@ -623,7 +1039,8 @@ class equilibrium(object):
             conn.closeTree('tcv_shot', int(shot))
             self._loaded = True
 
-        tind = np.abs(self._time_array - time).argmin()
+        tind = self._time_index(time)
+        self._tind = tind
         # print(tind)
         # print(self._time_array.shape)
         # print(self._psi.shape)
@@ -658,8 +1075,7 @@ class equilibrium(object):
         self._loaded = True
         self._time = 0.0  # self._psi.time[tind]
 
-        psiN_func = interp2d(self.R, self.Z, (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis))
-        self.psiN = equilibriumField((self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis), psiN_func)
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
         R = np.array(
             [0.624, 0.624, 0.666, 0.672, 0.965, 0.971, 1.136, 1.136, 0.971, 0.965, 0.672, 0.666, 0.624, 0.624, 0.624])
@@ -715,7 +1131,8 @@ class equilibrium(object):
             # we want to load also the plasma curent
             self._loaded = True
 
-        tind = np.abs(self._time_array - time).argmin()
+        tind = self._time_index(time)
+        self._tind = tind
         self.R = self._r  # .data[0,:]
         self.Z = self._z  # .data[0,:]
         psi_func = interp2d(self.R, self.Z, self._psi[tind])
@@ -742,9 +1159,7 @@ class equilibrium(object):
         self._loaded = True
         self._time = self._time_array[tind]
 
-        psiN_func = interp2d(self.R, self.Z, (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis))
-        self.psiN = equilibriumField(
-            (self.psi[:] - self.psi_axis) / (self.psi_bnd - self.psi_axis), psiN_func)
+        self.psiN = (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis)
 
         VesselFile = os.path.join(
             os.path.dirname(os.path.realpath(__file__)),
@@ -753,8 +1168,52 @@ class equilibrium(object):
         self.wall = {'R': x, 'Z': y}
         if with_bfield: self.calc_bfield()
 
+    # Attributes that depend on the time slice, saved and restored by set_time
+    _slice_attributes = ('R', 'Z', 'nr', 'nz', 'psi', 'psiN', 'psi_axis', 'psi_bnd', 'Rcent', 'Btcent', 'sigBp',
+                         'nxpt', 'xpoints', 'spoints', 'axis', 'fpol', 'fpolRZ', 'dpsidR', 'dpsidZ',
+                         'BR', 'BZ', 'Bp', 'Bt', 'B', 'wall', 'wallshadow_psiN', '_time', '_tind',
+                         '_flux_surfaces', '_fpolRZ_key')
+
+    def slice_times(self):
+        """ Times of the equilibrium time slices of the loaded shot """
+        if self.machine == 'MAST':
+            return np.asarray(self._psi.time)
+        elif self.machine == 'JET':
+            return np.asarray(self._t_psi)
+        else:
+            return np.asarray(self._time_array)
+
+    def _time_index(self, time):
+        """ Index of the equilibrium time slice nearest to time """
+        return np.abs(self.slice_times() - time).argmin()
+
+    def _store_slice(self):
+        """ Save the state of the current time slice in the LRU slice cache """
+        if self._tind is None or self.BR is None:
+            return
+        key = (self.machine, self._shot, self._tind)
+        self._slice_cache[key] = {attr: getattr(self, attr, None) for attr in self._slice_attributes}
+        self._slice_cache.move_to_end(key)
+        while len(self._slice_cache) > self.slice_cache_size:
+            self._slice_cache.popitem(last=False)
+
+    def clear_slice_cache(self):
+        self._slice_cache.clear()
+
     def set_time(self, time):
+        """
+        Move to the time slice nearest to time. The splines and fields of the slices visited are kept in an LRU
+        cache (of slice_cache_size slices), so returning to a slice only costs a lookup.
+        """
         if self._loaded and self.machine is not None:
+            self._store_slice()
+
+            key = (self.machine, self._shot, self._time_index(time))
+            if key in self._slice_cache:
+                self._slice_cache.move_to_end(key)
+                self.__dict__.update(self._slice_cache[key])
+                return
+
             if self.machine == 'MAST':
                 self.load_MAST(self._shot, time)
             elif self.machine == 'JET':
@@ -764,6 +1223,92 @@ class equilibrium(object):
             elif self.machine == 'AUG':
                 self.load_AUG(self._shot, time)
 
+            self._store_slice()
+
+    def _slice_stack(self):
+        """
+        Data for every time slice of the loaded shot
+
+        returns:
+            times, psi (nt, nz, nr), psi_axis, psi_bnd, Btcent (nt) and Rcent
+        """
+        def nearest(signal_times, values, times):
+            inds = np.abs(np.asarray(signal_times)[np.newaxis, :] - np.asarray(times)[:, np.newaxis]).argmin(axis=1)
+            return np.asarray(values)[inds]
+
+        if self.machine == 'MAST':
+            times = np.asarray(self._psi.time)
+            return (times, np.asarray(self._psi.data),
+                    nearest(self._psi_axis.time, self._psi_axis.data, times),
+                    nearest(self._psi_bnd.time, self._psi_bnd.data, times),
+                    nearest(self._bphi.time, self._bphi.data, times), self.Rcent)
+        elif self.machine == 'JET':
+            return (np.asarray(self._t_psi), self._psi_data, np.asarray(self._axs_data), np.asarray(self._bnd_data),
+                    np.asarray(self._r_bphi), self._r_at_bphi)
+        elif self.machine == 'AUG':
+            return (np.asarray(self._time_array), np.asarray(self._psi), np.asarray(self._psi_axis),
+                    np.asarray(self._psi_bnd), np.asarray(self._bphi), self.Rcent)
+        else:
+            raise NotImplementedError("Time interpolation is not available for " + str(self.machine))
+
+    def build_time_interpolant(self, method='linear'):
+        """
+        Build a (t, Z, R) interpolant of psi, psiN, BR and BZ over every time slice of the shot, for use by
+        fields_at. The poloidal field is found from the gradient of psi on the equilibrium grid of each slice, and
+        the toroidal field is taken to be the vacuum field Btcent(t)*Rcent/R.
+
+        keywords:
+            method = str    interpolation method passed to RegularGridInterpolator (default 'linear')
+        """
+        if not self._loaded or self.machine is None:
+            raise RuntimeError("No shot loaded, cannot interpolate in time")
+
+        times, psi, psi_axis, psi_bnd, Btcent, Rcent = self._slice_stack()
+        order = np.argsort(times)
+        times, psi, psi_axis, psi_bnd, Btcent = times[order], psi[order], psi_axis[order], psi_bnd[order], Btcent[order]
+
+        # Note np.gradient gives the Z derivative first, then the R derivative
+        dpsidZ, dpsidR = np.gradient(psi, self.Z, self.R, axis=(1, 2))
+        psiN = (psi - psi_axis[:, np.newaxis, np.newaxis]) / (psi_bnd - psi_axis)[:, np.newaxis, np.newaxis]
+
+        values = np.stack([psi, psiN, -dpsidZ / self.R, dpsidR / self.R], axis=-1)
+
+        self._time_interpolant = {'key': (self.machine, self._shot),
+                                  'times': times,
+                                  'Btcent': Btcent,
+                                  'Rcent': Rcent,
+                                  'fields': RegularGridInterpolator((times, self.Z, self.R), values, method=method,
+                                                                    bounds_error=False, fill_value=np.nan)}
+
+    def fields_at(self, times, R, Z):
+        """
+        Equilibrium fields at arbitrary times, interpolated between time slices, ie. at the time of every frame
+        of an IMSE image sequence. Times outside the range of the equilibrium take the first or last slice, points
+        outside the equilibrium grid are nan.
+
+        arguments:
+            times = array   times to evaluate at
+            R = array       major radii to evaluate at
+            Z = array       heights to evaluate at
+            times, R and Z are broadcast together, ie. times[:, np.newaxis] with the pixel R, Z gives (frame, pixel)
+
+        returns:
+            frameFields with psi, psiN, BR, BZ and Bt arrays of the broadcast shape
+        """
+        interpolant = getattr(self, '_time_interpolant', None)
+        if interpolant is None or interpolant['key'] != (self.machine, self._shot):
+            self.build_time_interpolant()
+            interpolant = self._time_interpolant
+
+        times, R, Z = np.broadcast_arrays(np.asarray(times, dtype=np.float64), np.asarray(R, dtype=np.float64),
+                                          np.asarray(Z, dtype=np.float64))
+        times = np.clip(times, interpolant['times'][0], interpolant['times'][-1])
+
+        fields = interpolant['fields'](np.stack([times, Z, R], axis=-1))
+        Bt = np.interp(times, interpolant['times'], interpolant['Btcent']) * interpolant['Rcent'] / R
+
+        return frameFields(fields[..., 0], fields[..., 1], fields[..., 2], fields[..., 3], Bt)
+
     def plot_flux(self, col_levels=None, Nlines=20, axes=None, wall_shadow=False, label_contours=False,
                   normalized_psi=False, show=True, title=None, colorbar=True, cmap=None, savename=None):
         """
@@ -845,47 +1390,39 @@ class equilibrium(object):
         else:
             print("ERROR: No poloidal flux found. Please load an equilibrium before plotting.\n")
 
+    def get_fluxsurface_paths(self, psiN):
+        """
+        All contour paths of psiN at each of the levels psiN (float or list). Contours are found for every level
+        not already calculated in one pass of contour_paths, and cached until the time slice changes.
+        """
+        levels = [float(level) for level in np.atleast_1d(psiN)]
+
+        if self._flux_surfaces is None or self._flux_surfaces[0] is not self.psiN:
+            self._flux_surfaces = (self.psiN, {})
+        cache = self._flux_surfaces[1]
+
+        missing = sorted(set(level for level in levels if level not in cache))
+        if missing:
+            for level, paths in zip(missing, contour_paths(self.R, self.Z, self.psiN[:], missing)):
+                cache[level] = paths
+
+        return [cache[level] for level in levels]
+
     def get_fluxsurface(self, psiN, Rref=1.5, Zref=0.0):
         """
-        Get R,Z coordinates of a flux surface at psiN
+        Get R,Z coordinates of a flux surface at psiN, the contour path passing closest to (Rref, Zref)
         """
-        try:
-            import matplotlib.pyplot as plt
-        except:
-            print("ERROR: matplotlib required for flux surface construction, returning")
-            return
+        def nearest(paths, level):
+            if len(paths) == 0:
+                raise ValueError("No flux surface found at psiN = " + str(level))
+            dist = [np.min((path[:, 0] - Rref) ** 2.0 + (path[:, 1] - Zref) ** 2.0) for path in paths]
+            path = paths[int(np.argmin(dist))]
+            return fluxSurface(R=path[:, 0], Z=path[:, 1])
 
         if type(psiN) is list:
-            surfaces = []
-            for psiNval in psiN:
-                psi_cont = plt.contour(self.R, self.Z, (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis),
-                                       levels=[0, psiN], alpha=0.0)
-                paths = psi_cont.collections[1].get_paths()
-                # Figure out which path to use
-                i = 0
-                old_dist = 100.0
-                for path in paths:
-                    dist = np.min(((path.vertices[:, 0] - Rref) ** 2.0 + (path.vertices[:, 1] - Zref) ** 2.0) ** 0.5)
-                    if dist < old_dist:
-                        true_path = path
-                        old_dist = dist
-
-                R, Z = true_path.vertices[:, 0], true_path.vertices[:, 1]
-                surfaces.append(fluxSurface(R=R, Z=Z))
-            return surfaces
+            return [nearest(paths, level) for paths, level in zip(self.get_fluxsurface_paths(psiN), psiN)]
         else:
-            psi_cont = plt.contour(self.R, self.Z, (self.psi - self.psi_axis) / (self.psi_bnd - self.psi_axis),
-                                   levels=[0, psiN], alpha=0.0)
-            paths = psi_cont.collections[1].get_paths()
-            old_dist = 100.0
-            for path in paths:
-                dist = np.min(((path.vertices[:, 0] - Rref) ** 2.0 + (path.vertices[:, 1] - Zref) ** 2.0) ** 0.5)
-                if dist < old_dist:
-                    true_path = path
-                    old_dist = dist
-            R, Z = true_path.vertices[:, 0], true_path.vertices[:, 1]
-            # plt.clf()
-            return fluxSurface(R=R, Z=Z)
+            return nearest(self.get_fluxsurface_paths(psiN)[0], psiN)
 
     def plot_var(self, var, title=None, col_levels=None, with_wall=False, axes=None, show=True, colorbar=True,
                  cbar_label=None, with_flux=False, cmap=None):
@@ -918,59 +1455,13 @@ class equilibrium(object):
     def count_wall_intersections(self, R, Z):
         """
         Check for an intersection between the line whose points are given by the numpy arrays (R,Z) and the wall
-        [note, based on wall_intersection method of pyFieldlineTracer, but converted to work on whole arrays at once
+        [note, based on wall_intersection method of pyFieldlineTracer, but converted to work on whole arrays at once.
+        Only wall segments near the line are tested, using the grid index of wallGeometry]
         """
-        xa = np.array(R[:-1])
-        ya = np.array(Z[:-1])
-        xb = np.array(R[1:])
-        yb = np.array(Z[1:])
-
-        wallxc = self.wall['R'][:-1]
-        wallyc = self.wall['Z'][:-1]
-        wallxd = self.wall['R'][1:]
-        wallyd = self.wall['Z'][1:]
-
-        # First check for intersection
-        def ccw_line_line_wall(xa, ya, xb, yb, xc, yc):
-            """
-            check if points are counterclockwise
-            xa, ya, xb, yb all have the same dimensions (points from the line)
-            xc, yc have the same dimensions (points from the wall)
-            returns 2d array with dimensions (len(xa), len(xc))
-            """
-            xa = xa[:, np.newaxis]
-            ya = ya[:, np.newaxis]
-            xb = xb[:, np.newaxis]
-            yb = yb[:, np.newaxis]
-            xc = xc[np.newaxis, :]
-            yc = yc[np.newaxis, :]
-            return (yc - ya) * (xb - xa) > (yb - ya) * (xc - xa)
-
-        def ccw_line_wall_wall(xa, ya, xc, yc, xd, yd):
-            """
-            check if points are counterclockwise
-            xa, ya have the same dimensions (points from the line)
-            xc, yc, xd, yd have the same dimensions (points from the wall)
-            returns 2d array with dimensions (len(xa), len(xd))
-            """
-            xa = xa[:, np.newaxis]
-            ya = ya[:, np.newaxis]
-            xc = xc[np.newaxis, :]
-            yc = yc[np.newaxis, :]
-            xd = xd[np.newaxis, :]
-            yd = yd[np.newaxis, :]
-            return (yd - ya) * (xc - xa) > (yc - ya) * (xd - xa)
-
-        # Note: multiplying arrays of booleans is equivalent to an elementwise 'AND' operation
-        intersections = (
-                (ccw_line_wall_wall(xa, ya, wallxc, wallyc, wallxd, wallyd) != ccw_line_wall_wall(xb, yb, wallxc,
-                                                                                                  wallyc, wallxd,
-                                                                                                  wallyd))
-                * (ccw_line_line_wall(xa, ya, xb, yb, wallxc, wallyc) != ccw_line_line_wall(xa, ya, xb, yb, wallxd,
-                                                                                            wallyd))
-        )
-        # Now each 'True' in intersections represents an intersection between an element of the line and an element of the wall
-        return intersections.sum()
+        if self._wall_geometry is None or self._wall_geometry[0] is not self.wall['R']:
+            self._wall_geometry = (self.wall['R'], wallGeometry(self.wall['R'], self.wall['Z']))
+
+        return self._wall_geometry[1].count_intersections(R, Z)
 
     def find_wall_shadow(self, region="outboard"):
         """
@@ -1054,9 +1545,13 @@ class equilibrium(object):
         self.wallshadow_psiN = psiNresult
         return psiNresult
 
-    def dump_equ(self, filename="equilibrium"):
+    def dump_equ(self, filename="equilibrium", binary=False):
         """
         Saves the equilibrium in a .equ file
+
+        keywords:
+            binary = bool   also save the same data to a filename.equ.npz sidecar (R, Z, psi, psi_bnd,
+                            Btcent, Rcent), much faster to write and read back than the text file
         """
 
         f = open(filename + '.equ', 'w')
@@ -1076,114 +1571,114 @@ class equilibrium(object):
         f.write('    rtf   = ' + str(self.Rcent) + ' m;\n')
         f.write('\n')
         f.write('    r(1:jm);\n')
-        ctr = 0.0
-        tmp = ''
-        for i in np.arange(len(self.R)):
-            if (ctr < 4):
-                tmp = tmp + str('%17.8f' % self.R[i])
-                ctr = ctr + 1.0
-            else:
-                tmp = tmp + str('%17.8f\n' % self.R[i])
-                f.write(tmp)
-                ctr = 0.0
-                tmp = ''
-        if (ctr != 0.0):
-            f.write(tmp + '\n')
+        write_block(f, self.R)
         f.write('')
 
         f.write('   z(1:km);\n')
-        ctr = 0.0
-        tmp = ''
-        for i in np.arange(len(self.Z)):
-            if (ctr < 4):
-
-                tmp = tmp + str('%17.8f' % self.Z[i])
-                ctr = ctr + 1.0
-            else:
-                tmp = tmp + str('%17.8f\n' % self.Z[i])
-                f.write(tmp)
-                ctr = 0.0
-                tmp = ''
-        if (ctr != 0.0):
-            f.write(tmp + '\n')
+        write_block(f, self.Z)
         f.write('')
 
         f.write('     ((psi(j,k)-psib,j=1,jm),k=1,km)\n')
-        ctr = 0.0
-        tmp = ''
-        for i in np.arange(len(self.Z)):
-            for j in np.arange(len(self.R)):
-                if (ctr < 4):
-                    tmp = tmp + str('%17.8f' % (self.psi[i, j] - self.psi_bnd))
-                    ctr = ctr + 1.0
-                else:
-                    tmp = tmp + str('%17.8f\n' % (self.psi[i, j] - self.psi_bnd))
-                    f.write(tmp)
-                    ctr = 0.0
-                    tmp = ''
-        if (ctr != 0.0):
-            f.write(tmp + '\n')
+        write_block(f, self.psi[:] - self.psi_bnd)
 
         f.close()
 
-    def __calc_psi_deriv(self, method='CD'):
+        if binary:
+            np.savez(filename + '.equ.npz', R=self.R, Z=self.Z, psi=self.psi[:], psi_bnd=self.psi_bnd,
+                     Btcent=self.Btcent, Rcent=self.Rcent)
+
+    def __calc_psi_deriv(self):
         """
-        Calculate the derivatives of the poloidal flux on the grid in R and Z
+        Derivatives of the poloidal flux in R and Z, from the analytic derivatives of the psi spline
         """
         if self.psi is None or self.R is None or self.Z is None:
             print("ERROR: Not enough information to calculate grad(psi). Returning.")
             return
 
-        if method is 'CD':  # 2nd order central differencing on an interpolated grid
-            R = np.linspace(np.min(self.R), np.max(self.R), 200)
-            Z = np.linspace(np.min(self.Z), np.max(self.Z), 200)
-            Rgrid, Zgrid = R, Z  # np.meshgrid(R,Z)
-            psi = self.psi(Rgrid, Zgrid)
-            deriv = np.gradient(psi)  # gradient wrt index
-            # Note np.gradient gives y derivative first, then x derivative
-            ddR = deriv[1]
-            # ddR = self.psi(Rgrid,Zgrid,dx=1)
-            ddZ = deriv[0]
-            # ddZ = self.psi(Rgrid,Zgrid,dy=1)
-            dRdi = 1.0 / np.gradient(R)
-            dZdi = 1.0 / np.gradient(Z)
-            dpsidR = ddR * dRdi[np.newaxis, :]  # Ensure broadcasting is handled correctly
-            dpsidZ = ddZ * dZdi[:, np.newaxis]
-            dpsidR_func = interp2d(R, Z, dpsidR)
-            dpsidZ_func = interp2d(R, Z, dpsidZ)
-
-            RR, ZZ = self.R, self.Z
-            self.dpsidR = equilibriumField(np.transpose(dpsidR_func(RR, ZZ)), dpsidR_func)
-            self.dpsidZ = equilibriumField(np.transpose(dpsidZ_func(RR, ZZ)), dpsidZ_func)
-        else:
-            print("ERROR: Derivative method not implemented yet, reverting to CD")
-            self.calc_psi_deriv(method='CD')
+        psi_func = self.psi._func
+
+        def dpsidR_func(R, Z, grid=True):
+            return psi_func(R, Z, dx=1, grid=grid)
 
-    def calc_bfield(self):
+        def dpsidZ_func(R, Z, grid=True):
+            return psi_func(R, Z, dy=1, grid=grid)
 
-        """Calculate magnetic field components"""
+        self.dpsidR = equilibriumField(None, dpsidR_func, grid=(self.R, self.Z))
+        self.dpsidZ = equilibriumField(None, dpsidZ_func, grid=(self.R, self.Z))
 
+    def calc_bfield(self, plasma_response=False):
+
+        """
+        Calculate magnetic field components. The components are functions of (R, Z) built on the derivatives of
+        the psi spline, with the same call signature as the splines, and are only evaluated on the equilibrium
+        grid when their data is first used.
+
+        keywords:
+            plasma_response = bool  use fpol(psi) inside the plasma for the toroidal field, rather than
+                                    the vacuum field everywhere (default False)
+        """
+
+        self.__get_fpolRZ(plasma_response=plasma_response)
+        self.__build_bfield()
+
+    def __build_bfield(self):
+        """
+        Field components as expressions of the psi derivatives, fpolRZ and R, evaluated lazily
+        """
         self.__calc_psi_deriv()
 
-        BR = -1.0 * self.dpsidZ / self.R[np.newaxis, :]
-        BZ = self.dpsidR / self.R[np.newaxis, :]
-        Bp = self.sigBp * (BR ** 2.0 + BZ ** 2.0) ** 0.5
+        def R_func(R, Z, grid=True):
+            # R in the (R, Z) layout of the spline output
+            R, Z = np.asarray(R, dtype=np.float64), np.asarray(Z, dtype=np.float64)
+            if grid:
+                return np.broadcast_to(np.reshape(R, (-1, 1)), (R.size, Z.size))
+            return np.broadcast_arrays(R, Z)[0]
+
+        R = equilibriumField(None, R_func, grid=(self.R, self.Z))
+
+        self.BR = -1.0 * self.dpsidZ / R
+        self.BZ = self.dpsidR / R
+        self.Bp = self.sigBp * (self.BR ** 2.0 + self.BZ ** 2.0) ** 0.5
+        self.Bt = self.fpolRZ / R
+        self.B = (self.BR ** 2.0 + self.BZ ** 2.0 + self.Bt ** 2.0) ** 0.5
+
+    def evaluate_points(self, R, Z, chunk_size=2**16):
+        """
+        Evaluate psiN, BR, BZ and Bt together at scattered points, ie. the MSESIM grid coordinates or points
+        sampled along a beam. Each chunk of points is evaluated with one pass of the psi spline and its derivatives.
+
+        arguments:
+            R = array   major radius of the points
+            Z = array   height of the points, broadcast with R
+
+        keywords:
+            chunk_size = int    number of points evaluated at a time, limits the size of temporary arrays
+
+        returns:
+            pointFields with psiN, BR, BZ and Bt arrays of the broadcast shape of R and Z
+        """
+        if self.psi is None:
+            raise RuntimeError("No equilibrium loaded, cannot evaluate fields")
+        if self.fpolRZ is None:
+            self.__get_fpolRZ()
+
+        psi_func = self.psi._func
+        fpol_func = self.fpolRZ._func
 
-        self.__get_fpolRZ()
-        Bt = self.fpolRZ / self.R[np.newaxis, :]
-        B = (BR ** 2.0 + BZ ** 2.0 + Bt ** 2.0) ** 0.5
+        R, Z = np.broadcast_arrays(np.asarray(R, dtype=np.float64), np.asarray(Z, dtype=np.float64))
+        out = np.empty((4,) + R.shape)
 
-        BR_func = interp2d(self.R, self.Z, BR)
-        BZ_func = interp2d(self.R, self.Z, BZ)
-        Bp_func = interp2d(self.R, self.Z, Bp)
-        Bt_func = interp2d(self.R, self.Z, Bt)
-        B_func = interp2d(self.R, self.Z, B)
+        R_points, Z_points, out_points = R.ravel(), Z.ravel(), out.reshape(4, -1)
+        for start in range(0, R_points.size, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            r, z = R_points[chunk], Z_points[chunk]
 
-        self.BR = equilibriumField(BR, BR_func)
-        self.BZ = equilibriumField(BZ, BZ_func)
-        self.Bp = equilibriumField(Bp, Bp_func)
-        self.Bt = equilibriumField(Bt, Bt_func)
-        self.B = equilibriumField(B, B_func)
+            out_points[0, chunk] = (psi_func(r, z, grid=False) - self.psi_axis) / (self.psi_bnd - self.psi_axis)
+            out_points[1, chunk] = -1.0 * psi_func(r, z, dy=1, grid=False) / r
+            out_points[2, chunk] = psi_func(r, z, dx=1, grid=False) / r
+            out_points[3, chunk] = fpol_func(r, z, grid=False) / r
+
+        return pointFields(out[0], out[1], out[2], out[3])
 
     def __get_fpolRZ(self, plasma_response=False):
         """
@@ -1195,24 +1690,116 @@ class equilibrium(object):
         reverse engineer
 
         """
-        from scipy.interpolate import interp1d
+        plasma_response = plasma_response and self.fpol is not None
 
-        fpolRZ = np.zeros((self.nz, self.nr))
+        # fpolRZ only changes with the time slice, the flux function or the vacuum field
+        key = (self.psi, self.fpol if plasma_response else None, self.Btcent, self.Rcent)
+        if self.fpolRZ is not None and self._fpolRZ_key is not None and all(
+                a is b or (np.isscalar(a) and a == b) for a, b in zip(key, self._fpolRZ_key)):
+            return
 
-        if plasma_response and self.fpol is not None:
-            psigrid = np.linspace(self.psi_axis, self.psi_bnd, len(self.fpol))
-            for i in np.arange(self.nr):
-                for j in np.arange(self.nz):
-                    if self.psi[i, j] < psigrid[-1] and self.psi[i, j] > psigrid[0]:
-                        fpolRZ[i, j] = self.fpol(self.psi[i, j])
-                    else:
-                        fpolRZ[i, j] = self.Btcent * self.Rcent
+        psi = self.psi[:]
+        fpolRZ = np.full(np.shape(psi), self.Btcent * self.Rcent, dtype=np.float64)
 
-        else:
-            fpolRZ[:, :] = self.Btcent * self.Rcent
+        if plasma_response:
+            fpol = np.asarray(self.fpol[:], dtype=np.float64)
+            psigrid = np.linspace(self.psi_axis, self.psi_bnd, len(fpol))
+            fpol_func = self.fpol._func if self.fpol._func is not None else interp1d(psigrid, fpol)
+
+            # Vacuum field outside the range fpol is given over, whichever way psi increases
+            inside = (psi > np.min(psigrid)) & (psi < np.max(psigrid))
+            fpolRZ[inside] = fpol_func(psi[inside])
 
         fpolRZ_func = interp2d(self.R, self.Z, fpolRZ)
         self.fpolRZ = equilibriumField(fpolRZ, fpolRZ_func)
+        self._fpolRZ_key = key
+
+
+class _prefetchedSignals(object):
+    """ Client serving signals already fetched by load_equilibria """
+
+    def __init__(self, signals):
+        self._signals = signals
+
+    def get(self, name, shot):
+        return self._signals[(name, shot)]
+
+
+def _window_times(times, window):
+    """ Slice times inside window = (tmin, tmax), or the slice nearest to window if it is a single time """
+    times = np.asarray(times)
+    if np.ndim(window) == 0:
+        return times[[np.abs(times - window).argmin()]]
+    return times[(times >= window[0]) & (times <= window[1])]
+
+
+def load_equilibria(requests, client=None, max_workers=8, with_bfield=True, verbose=False):
+    """
+    Load equilibria for every time slice of several shots
+
+    For MAST, the signals of every shot are fetched concurrently through a thread pool over the data access
+    client (see Tools.data_access) before any equilibrium is built. Other devices are loaded one shot at a time,
+    with the data of each shot read once and shared between its slices.
+
+    arguments:
+        requests = list     (device, shot, window) for each shot, where window is a (tmin, tmax) time window
+                            or a single time to take the nearest slice to
+
+    keywords:
+        client = data access client for MAST signals, defaults to IDAM with the local shot cache
+        max_workers = int   number of signals fetched at once
+
+    returns:
+        list with, for each request, a list of equilibrium objects, one per time slice in the window
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    mast_shots = sorted(set(shot for device, shot, window in requests if device == 'MAST'))
+
+    signals = {}
+    if mast_shots:
+        if client is None:
+            try:
+                from Tools.data_access import get_client
+            except:
+                raise ImportError("No data_access module found, cannot load MAST shots")
+            client = get_client('idam')
+
+        keys = [(name, shot) for shot in mast_shots for name in MAST_SIGNALS.values()]
+        if verbose: print("Fetching " + str(len(keys)) + " signals for " + str(len(mast_shots)) + " MAST shots")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            fetched = pool.map(lambda key: client.get(*key), keys)
+            signals = dict(zip(keys, fetched))
+
+    prefetched = _prefetchedSignals(signals)
+
+    results = []
+    for device, shot, window in requests:
+        if device == 'MAST':
+            times = _window_times(prefetched.get(MAST_SIGNALS['_psi'], shot).time, window)
+            slices = []
+            for time in times:
+                eq = equilibrium()
+                eq.load_MAST(shot, time, with_bfield=with_bfield, verbose=verbose, client=prefetched)
+                slices.append(eq)
+        else:
+            first = equilibrium(device=device, shot=shot, time=np.mean(window), with_bfield=with_bfield,
+                                verbose=verbose)
+            slices = []
+            for time in _window_times(first.slice_times(), window):
+                # Share the shot data already read by the first slice
+                eq = equilibrium.__new__(equilibrium)
+                eq.__dict__.update(first.__dict__)
+                eq._slice_cache = OrderedDict()
+                eq._flux_surfaces = None
+                eq._wall_geometry = None
+                eq.set_time(time)
+                slices.append(eq)
+
+        results.append(slices)
+
+    return results
 
 
 if __name__ == '__main__':
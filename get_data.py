@@ -1,7 +1,9 @@
-import pyuda
 import idlbridge as idl
 
-client = pyuda.Client()
+from Tools.data_access import get_client
+
+#Signals are recorded in the local shot cache, use get_client('offline') with no network
+client = get_client('uda')
 
 shotnumber = 24409
 